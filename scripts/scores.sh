@@ -6,34 +6,12 @@ SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 RESPONSES_DIR="$SCRIPT_DIR/../responses"
 SRC_DIR="$SCRIPT_DIR/../src"
 
-# Process all yesno files (BINARY)
-for file in "$RESPONSES_DIR"/yesno_*.csv; do
-    if [ -f "$file" ]; then
-        model=$(echo "$file" | sed -E 's/.*yesno_responses_(.*)\.csv/\1/')
-        echo "Evaluating model: $model (BINARY)"
-        python3 "$SRC_DIR/evaluate.py" -response_path "$file" -label_type BINARY
-        echo ""
-    fi
-done
-
-# Process all radio files (MULTICLASS)
-for file in "$RESPONSES_DIR"/radio_*.csv; do
-    if [ -f "$file" ]; then
-        model=$(echo "$file" | sed -E 's/.*radio_responses_(.*)\.csv/\1/')
-        echo "Evaluating model: $model (MULTICLASS)"
-        python3 "$SRC_DIR/evaluate.py" -response_path "$file" -label_type MULTICLASS
-        echo ""
-    fi
-done
-
-# Process all checkbox files (MULTILABEL)
-for file in "$RESPONSES_DIR"/checkbox_*.csv; do
-    if [ -f "$file" ]; then
-        model=$(echo "$file" | sed -E 's/.*checkbox_responses_(.*)\.csv/\1/')
-        echo "Evaluating model: $model (MULTILABEL)"
-        python3 "$SRC_DIR/evaluate.py" -response_path "$file" -label_type MULTILABEL
-        echo ""
-    fi
-done
+# Evaluate every yesno (BINARY), radio (MULTICLASS) and checkbox (MULTILABEL) response file in one process.
+# Pass an output file (.csv or .json) to also save the model x task results table, e.g. ./scripts/scores.sh scores.json
+if [ -n "$1" ]; then
+    python3 "$SRC_DIR/evaluate.py" -dir "$RESPONSES_DIR" -output "$1"
+else
+    python3 "$SRC_DIR/evaluate.py" -dir "$RESPONSES_DIR"
+fi
 
 echo "All evaluations completed!"
@@ -0,0 +1,39 @@
+from itertools import combinations
+
+# Finite-state grammar of the answers a question type may produce
+class AnswerGrammar:
+    """DFA (a trie) accepting a finite set of answer strings; state 0 is the start, nothing has been generated"""
+
+    def __init__(self, name, answers):
+        self.name = name
+        self.answers = sorted(answers)
+        self.max_length = max(len(answer) for answer in self.answers)
+        # state -> {character: next state}
+        self.transitions = [{}]
+        self.accepting = set()
+        for answer in self.answers:
+            state = 0
+            for char in answer:
+                if char not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.transitions[state][char] = len(self.transitions) - 1
+                state = self.transitions[state][char]
+            self.accepting.add(state)
+
+    def step(self, state, text):
+        """State after reading text from state, None if text leaves the grammar"""
+        for char in text:
+            state = self.transitions[state].get(char)
+            if state is None:
+                return None
+        return state
+
+    def isAccepting(self, state):
+        return state in self.accepting
+
+def checkboxAnswers(letters="abcd", none_of_the_above="e"):
+    """Sorted comma-separated non-empty subsets of the options, or 'none of the above' alone"""
+    answers = [none_of_the_above]
+    for size in range(1, len(letters) + 1):
+        answers += [",".join(subset) for subset in combinations(letters, size)]
+    return answers
@@ -0,0 +1,396 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import evaluate
+import generateQuestionsFromRDF as rdf
+
+class bcolors:
+    BLUE = '\033[94m'
+    RED = '\033[91m'
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    ENDC = '\033[0m'
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_PATH = os.path.join(SRC_DIR, "..", "datasets", "spatial_reasoning.csv")
+
+# Synthetic inputs
+
+# relations with an inverse, so that every generator accepts them
+RELATIONS = sorted(rdf.INVERSE_RELATION)
+
+def write_synthetic_nt(path, num_triples, relations_per_subject=3, objects_per_relation=3, seed=0):
+    """N-Triples file of num_triples zipcode triples, every subject has enough objects for checkbox questions"""
+    rng = random.Random(seed)
+    num_entities = max(num_triples // (relations_per_subject * objects_per_relation), 2)
+    written = 0
+    with open(path, "w") as f:
+        while written < num_triples:
+            subject = rng.randrange(num_entities)
+            for relation in rng.sample(RELATIONS, relations_per_subject):
+                for _ in range(objects_per_relation):
+                    obj = rng.randrange(num_entities)
+                    f.write(f"<http://spatex.org/Zipcode_{10000 + subject}> <http://spatex.org/{relation.replace(' ', '_')}> "
+                            f"<http://spatex.org/Zipcode_{10000 + obj}> .\n")
+                    written += 1
+
+def write_synthetic_responses(path, label_type, num_rows, invalid_rate=0.05, seed=0):
+    """Response CSV with random truths and responses (and some invalid responses) of a label type"""
+    rng = random.Random(seed)
+    letters = ['a', 'b', 'c', 'd', 'e']
+    def answer():
+        if label_type == 'BINARY':
+            return rng.choice(['yes', 'no'])
+        if label_type == 'MULTICLASS':
+            return rng.choice(letters)
+        return ",".join(sorted(rng.sample(letters[:4], rng.randint(1, 4)))) if rng.random() < 0.8 else "e"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["query", "truth", "response"])
+        for i in range(num_rows):
+            response = "no response" if rng.random() < invalid_rate else answer()
+            writer.writerow([f"query {i}", answer(), response])
+
+def write_tiny_model(path, num_hidden_layers=2, hidden_size=64):
+    """A randomly initialized (2-layer, 64-wide) Llama with a byte-level tokenizer and a chat template, for CPU runs"""
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+    alphabet = sorted(pre_tokenizers.ByteLevel.alphabet())
+    tokenizer = Tokenizer(models.BPE(vocab={char: i for i, char in enumerate(alphabet)}, merges=[]))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", pad_token="<pad>")
+    tokenizer.chat_template = (
+        "{% for message in messages %}<|{{ message['role'] }}|>{{ message['content'] }}\n{% endfor %}"
+        "{% if add_generation_prompt %}<|assistant|>{% endif %}"
+    )
+    tokenizer.save_pretrained(path)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, intermediate_size=2 * hidden_size, num_hidden_layers=num_hidden_layers,
+        num_attention_heads=4, num_key_value_heads=4, max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id, eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id,
+    )
+    torch.manual_seed(0)
+    LlamaForCausalLM(config).save_pretrained(path)
+
+# Benchmarks: setup(workdir, args) returns a run() callable, only run() is timed.
+# run() may return a dict of extra metrics to store with the timing
+
+def bench_parse_nt_file(num_triples):
+    def setup(workdir, args):
+        path = os.path.join(workdir, f"graph_{num_triples}.nt")
+        write_synthetic_nt(path, num_triples)
+        def run():
+            rdf.ENTITY_INDEX = rdf.EntityIndex()
+            rdf.parse_nt_file(path)
+            return {"triples_per_second": num_triples}
+        return run
+    return setup
+
+def load_benchmark_graph(workdir, args):
+    path = os.path.join(workdir, "generators.nt")
+    if not os.path.exists(path):
+        write_synthetic_nt(path, args.graph_triples)
+    return rdf.load_entity_index(path)
+
+def bench_generator(generate):
+    def setup(workdir, args):
+        index = load_benchmark_graph(workdir, args)
+        random.seed(0)
+        triples = index.sample_triples(args.questions)
+        def run():
+            for triple in triples:
+                generate(triple)
+            return {"questions_per_second": len(triples)}
+        return run
+    return setup
+
+def bench_bulk_generator(qtype):
+    def setup(workdir, args):
+        index = load_benchmark_graph(workdir, args)
+        def run():
+            rdf.BULK_GENERATORS[qtype](index, rdf.np.random.default_rng(0), args.questions)
+            return {"questions_per_second": args.questions}
+        return run
+    return setup
+
+def bench_evaluator(task):
+    label_type, evaluator = evaluate.EVALUATORS[task]
+    def setup(workdir, args):
+        path = os.path.join(workdir, f"responses_{label_type}.csv")
+        write_synthetic_responses(path, label_type, args.response_rows)
+        df = evaluate.read_responses(path)
+        def run():
+            evaluator(df, verbose=False)
+            return {"rows_per_second": args.response_rows}
+        return run
+    return setup
+
+def bench_get_responses(workdir, args):
+    """End-to-end getResponses.py run (process startup, model load and generation) with a tiny random model on CPU"""
+    model_path = os.path.join(workdir, "tiny_model")
+    write_tiny_model(model_path)
+    dataset_path = os.path.join(workdir, "queries.csv")
+    with open(DATASET_PATH, newline="") as src, open(dataset_path, "w", newline="") as dst:
+        reader, writer = csv.reader(src), csv.writer(dst, lineterminator="\n")
+        for i, row in enumerate(reader):
+            if i > args.e2e_queries:
+                break
+            writer.writerow(row)
+    output_path = os.path.join(workdir, "responses.csv")
+    command = [
+        sys.executable, os.path.join(SRC_DIR, "getResponses.py"),
+        "-query_dataset_path", dataset_path, "-query_result_path", output_path, "-model", model_path,
+        "-batch_size", str(args.e2e_batch_size), "-max_new_tokens", str(args.e2e_max_new_tokens), "-trace",
+    ]
+    environment = dict(os.environ, CUDA_VISIBLE_DEVICES="")
+    def run():
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, env=environment)
+        with open(os.path.join(workdir, "responses.trace.jsonl")) as f:
+            summary = [json.loads(line) for line in f][-1]["all"]
+        return {"queries_per_second": summary["queries_per_second"], "tokens_per_second": summary["tokens_per_second"]}
+    return run
+
+def read_queries(num_queries):
+    """User prompts (query + instruction) of the first queries of the dataset"""
+    from getResponses import QUERY_TYPES
+    with open(DATASET_PATH, newline="") as f:
+        rows = list(itertools.islice(csv.reader(f), 1, num_queries + 1))
+    return [query + QUERY_TYPES[qtype][0] for qtype, query, _ in rows]
+
+def bench_assisted_generation(workdir, args):
+    """Greedy assisted generation of a tiny 2-layer model with a 1-layer draft model sharing its tokenizer, on CPU"""
+    from llm_class import PlainLLM
+    model_path, draft_path = os.path.join(workdir, "assisted_model"), os.path.join(workdir, "draft_model")
+    write_tiny_model(model_path)
+    write_tiny_model(draft_path, num_hidden_layers=1)
+    prompts = read_queries(args.e2e_queries)
+    llm = PlainLLM(model_path)
+    llm.decoding_params = {"max_new_tokens": args.e2e_max_new_tokens, "do_sample": False}
+    # reference: plain greedy decoding, one prompt at a time like assisted generation
+    expected = [llm.generateBatch([prompt])[0] for prompt in prompts]
+    llm.draft_modelid = draft_path
+    llm.loadDraftModel()
+    def run():
+        generated_tokens = llm.getAssistedStats()["generated_tokens"]
+        responses = llm.generateBatch(prompts)
+        stats = llm.getAssistedStats()
+        return {
+            "tokens_per_second": stats["generated_tokens"] - generated_tokens,
+            "acceptance_rate": stats["acceptance_rate"],
+            "greedy_match_rate": sum(response == reference for response, reference in zip(responses, expected)) / len(prompts),
+        }
+    return run
+
+def bench_cpu_generation(device, quantize_bits=None):
+    """Greedy batched generation of a small random model (4 layers, 512 wide) on CPU"""
+    def setup(workdir, args):
+        from llm_class import PlainLLM
+        model_path = os.path.join(workdir, "cpu_model")
+        if not os.path.exists(model_path):
+            write_tiny_model(model_path, num_hidden_layers=4, hidden_size=512)
+        prompts = read_queries(args.e2e_queries)
+        # device "cuda" is the original device_map="auto" bfloat16 path, which lands on the CPU without a GPU
+        llm = PlainLLM(model_path, quantize_bits=quantize_bits, device=device)
+        llm.decoding_params = {"max_new_tokens": args.e2e_max_new_tokens, "do_sample": False}
+        llm.instrument = True
+        def run():
+            generated_tokens = 0
+            for start in range(0, len(prompts), args.e2e_batch_size):
+                llm.generateBatch(prompts[start:start + args.e2e_batch_size])
+                generated_tokens += sum(llm.last_call_stats["generated_tokens"])
+            return {"tokens_per_second": generated_tokens}
+        return run
+    return setup
+
+class StubCompletionsHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI-style /chat/completions stub echoing the last message after server.delay seconds. A message containing
+    'retry' gets a 429 the first time it is seen, one containing 'slow' takes server.slow_delay seconds
+    """
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        content = payload["messages"][-1]["content"]
+        with self.server.lock:
+            first = content not in self.server.seen
+            self.server.seen.add(content)
+        if "retry" in content and first:
+            self.server.rejected += 1
+            self.send_response(429)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(self.server.slow_delay if "slow" in content else self.server.delay)
+        body = json.dumps({
+            "choices": [{"message": {"content": content}, "finish_reason": "stop"} for _ in range(payload.get("n", 1))],
+            "usage": {"prompt_tokens": len(content), "completion_tokens": len(content)},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def bench_openai_backend(workdir, args):
+    """
+    OpenAILLM against a local stub server: many more requests than -max_in_flight slots, with 429s to retry. Checks
+    (once) that responses keep the input order, that 429s are retried, that queued requests do not time out and
+    that a request slower than the timeout fails; run() times a batch through 4 slots
+    """
+    from openai_llm import OpenAILLM
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCompletionsHandler)
+    server.daemon_threads = True
+    server.lock, server.seen, server.rejected = threading.Lock(), set(), 0
+    server.delay, server.slow_delay = 0.05, 2.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # the batch waits ~ 64 / 4 * 0.05 s for its slots, longer than the timeout of a single request
+    llm = OpenAILLM("stub", f"http://127.0.0.1:{server.server_port}/v1", max_in_flight=4, request_timeout=0.5,
+                    max_retries=1, retry_backoff=0.01)
+    prompts = [f"question {i}" + (" retry" if i % 8 == 0 else "") for i in range(64)]
+    expected = [llm.getMessages(prompt)[0]["content"] for prompt in prompts]
+    if llm.generateBatch(prompts) != expected:
+        raise RuntimeError("OpenAILLM returned the stub responses out of order")
+    if server.rejected != len([prompt for prompt in prompts if "retry" in prompt]):
+        raise RuntimeError(f"The stub rejected {server.rejected} requests with 429, expected one per 'retry' prompt")
+    try:
+        llm.generateBatch(["slow"])
+        raise RuntimeError("A request slower than request_timeout did not fail")
+    except RuntimeError as e:
+        if "attempts" not in str(e):
+            raise
+    def run():
+        llm.generateBatch(prompts)
+        return {"requests_per_second": len(prompts)}
+    return run
+
+def get_benchmarks(args):
+    """name -> setup of every benchmark"""
+    benchmarks = {}
+    for size in args.nt_sizes:
+        benchmarks[f"parse_nt_file_{size}"] = bench_parse_nt_file(size)
+    benchmarks["generate_yesno_question"] = bench_generator(rdf.generate_yesno_question)
+    benchmarks["generate_radio_question"] = bench_generator(rdf.generate_radio_question)
+    benchmarks["generate_checkbox_question"] = bench_generator(rdf.generate_checkbox_question)
+    benchmarks["bulk_yesno_questions"] = bench_bulk_generator("yes/no")
+    benchmarks["bulk_radio_questions"] = bench_bulk_generator("radio")
+    benchmarks["bulk_checkbox_questions"] = bench_bulk_generator("checkbox")
+    benchmarks["evaluate_binary"] = bench_evaluator('yesno')
+    benchmarks["evaluate_multiclass"] = bench_evaluator('radio')
+    benchmarks["evaluate_multilabel"] = bench_evaluator('checkbox')
+    benchmarks["get_responses_e2e"] = bench_get_responses
+    benchmarks["assisted_generation"] = bench_assisted_generation
+    benchmarks["openai_backend_stub"] = bench_openai_backend
+    # CPU backend against the default path, on the same model
+    benchmarks["cpu_generation_default"] = bench_cpu_generation("cuda")
+    benchmarks["cpu_generation_cpu"] = bench_cpu_generation("cpu")
+    benchmarks["cpu_generation_cpu_int8"] = bench_cpu_generation("cpu", quantize_bits=8)
+    return benchmarks
+
+def run_benchmarks(args):
+    """Best-of-repeat wall time of every benchmark, its per-second metrics are computed from the best run"""
+    results = {}
+    benchmarks = get_benchmarks(args)
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, setup in benchmarks.items():
+            if args.only and not re.search(args.only, name):
+                continue
+            times, extra = [], {}
+            try:
+                run = setup(workdir, args)
+                # the end-to-end run is expensive, one repetition is enough
+                for _ in range(1 if name == "get_responses_e2e" else args.repeat):
+                    start = time.perf_counter()
+                    extra = run() or {}
+                    times.append(time.perf_counter() - start)
+            except ImportError as e:
+                print(bcolors.WARNING + f"{name}: skipped ({e})" + bcolors.ENDC)
+                results[name] = {"skipped": str(e)}
+                continue
+            except Exception as e:
+                # e.g. CUDA or bitsandbytes errors on a CPU-only machine, the other benchmarks still run
+                print(bcolors.RED + f"{name}: failed ({type(e).__name__}: {e})" + bcolors.ENDC)
+                results[name] = {"failed": f"{type(e).__name__}: {e}"}
+                continue
+            best = min(times)
+            result = {"seconds": best, "runs": times}
+            for metric, value in extra.items():
+                # work units are turned into rates of the best run, other values are stored as measured
+                result[metric] = value / best if metric.endswith("_per_second") and name != "get_responses_e2e" else value
+            results[name] = result
+            print(f"{bcolors.BLUE}{name}:{bcolors.ENDC} {best * 1000:.1f} ms")
+    return results
+
+def compare_baseline(results, baseline, threshold):
+    """Attach the baseline time and ratio to every result, returns the names of the regressed benchmarks"""
+    regressions = []
+    for name, result in results.items():
+        if "seconds" not in result or name not in baseline:
+            continue
+        result["baseline"] = baseline[name]
+        result["ratio"] = result["seconds"] / baseline[name]
+        result["regressed"] = result["ratio"] > 1 + threshold
+        if result["regressed"]:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parser, question generators, evaluators and the end-to-end response collection.")
+    parser.add_argument("-output", type=str, default="benchmark_results.json", help="JSON file of the results")
+    parser.add_argument("-baseline", type=str, default=None, help="JSON file of baseline times ({benchmark: seconds}) to compare against")
+    parser.add_argument("-update_baseline", action="store_true", help="Write the measured times to the -baseline file instead of comparing")
+    parser.add_argument("-threshold", type=float, default=0.2, help="Relative slowdown over the baseline that counts as a regression")
+    parser.add_argument("-repeat", type=int, default=5, help="Runs per benchmark, the fastest one is kept")
+    parser.add_argument("-only", type=str, default=None, help="Regex of the benchmark names to run")
+    parser.add_argument("-nt_sizes", type=lambda value: [int(size) for size in value.split(",")], default=[10000, 100000, 1000000],
+                        help="Comma-separated numbers of triples of the synthetic N-Triples files to parse")
+    parser.add_argument("-graph_triples", type=int, default=100000, help="Triples of the graph the question generators draw from")
+    parser.add_argument("-questions", type=int, default=10000, help="Questions generated per generator run")
+    parser.add_argument("-response_rows", type=int, default=100000, help="Rows of the synthetic response files")
+    parser.add_argument("-e2e_queries", type=int, default=32, help="Queries answered by the end-to-end getResponses run")
+    parser.add_argument("-e2e_batch_size", type=int, default=8, help="Batch size of the end-to-end getResponses run")
+    parser.add_argument("-e2e_max_new_tokens", type=int, default=16, help="Generated tokens per sample in the end-to-end getResponses run")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({name: result["seconds"] for name, result in results.items() if "seconds" in result}, f, indent=2)
+        print(bcolors.GREEN + f"Baseline written to {args.baseline}" + bcolors.ENDC)
+    regressions = []
+    if args.baseline and not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare_baseline(results, json.load(f), args.threshold)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "machine": {"python": platform.python_version(), "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count()},
+            "threshold": args.threshold,
+            "benchmarks": results,
+        }, f, indent=2)
+
+    for name in regressions:
+        result = results[name]
+        print(bcolors.RED + f"Regression: {name} took {result['seconds'] * 1000:.1f} ms, "
+              f"{result['ratio']:.2f}x the baseline {result['baseline'] * 1000:.1f} ms" + bcolors.ENDC)
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,429 @@
-import pandas as pd
-from sklearn.metrics import precision_score, recall_score, f1_score
-from sklearn.preprocessing import MultiLabelBinarizer
+import time
+STARTUP = time.perf_counter()
 import argparse
+import csv
+import json
+import os
+import re
+from collections import Counter
+from fractions import Fraction
+from functools import lru_cache
+from itertools import islice
 
 class bcolors:
     BLUE = '\033[94m'
     RED = '\033[91m'
     ENDC = '\033[0m'
 
-def evaluate_multilabel(df):
+# Metrics follow the sklearn definitions (precision_score/recall_score/f1_score with zero_division=0),
+# computed directly so that scoring a response file does not need pandas or scikit-learn
+
+def safe_div(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+def column(df, name):
+    """Column values as strings (missing values become empty strings)"""
+    return ["" if not isinstance(value, str) else value for value in df[name]]
+
+# Answers are encoded as bitmasks (labels a-e as bits 0-4, yes as 1 and no as 0), so a response file reduces to
+# the counts of its (truth, response) mask pairs: at most 32 x 32 integers, whatever the number of rows
+LABEL_BITS = {label: 1 << i for i, label in enumerate('abcde')}
+INVALID = -1
+MAX_INVALID_EXAMPLES = 20
+
+@lru_cache(maxsize=65536)
+def encode_binary(value):
+    return 1 if value == 'yes' else 0 if value == 'no' else INVALID
+
+@lru_cache(maxsize=65536)
+def encode_multiclass(value):
+    return LABEL_BITS.get(value.strip(), INVALID)
+
+@lru_cache(maxsize=65536)
+def encode_multilabel(value):
+    # labels outside a-e are ignored, so every value is valid
+    mask = 0
+    for label in value.replace(' ', '').split(','):
+        mask |= LABEL_BITS.get(label, 0)
+    return mask
+
+ENCODERS = {'BINARY': encode_binary, 'MULTICLASS': encode_multiclass, 'MULTILABEL': encode_multilabel}
+
+def count_label_pairs(truths, responses, label_type, counts=None, invalid=None):
+    """
+    Add the mask pair counts of a chunk of rows to counts ({truth_mask << 5 | response_mask: rows}) and
+    examples of invalid values to invalid ({'truth': set, 'response': set}). Returns both
+    """
+    encode = ENCODERS[label_type]
+    counts = Counter() if counts is None else counts
+    invalid = {'truth': set(), 'response': set()} if invalid is None else invalid
+    for true, pred in zip(truths, responses):
+        true_mask, pred_mask = encode(true), encode(pred)
+        if true_mask == INVALID or pred_mask == INVALID:
+            for name, value, mask in (('truth', true, true_mask), ('response', pred, pred_mask)):
+                if mask == INVALID and len(invalid[name]) < MAX_INVALID_EXAMPLES:
+                    invalid[name].add(value.strip())
+            continue
+        counts[true_mask << 5 | pred_mask] += 1
+    return counts, invalid
+
+def metrics_from_counts(counts, label_type, rows):
+    """Precision/recall/F1 of a mask pair count table"""
+    if label_type == 'BINARY':
+        tp, fp, fn = counts[1 << 5 | 1], counts[0 << 5 | 1], counts[1 << 5 | 0]
+        return {"precision": safe_div(tp, tp + fp), "recall": safe_div(tp, tp + fn), "f1": safe_div(2 * tp, 2 * tp + fp + fn)}
+    if label_type == 'MULTICLASS':
+        # macro average over the labels present in either column
+        precisions, recalls, f1s = [], [], []
+        for bit in LABEL_BITS.values():
+            tp = counts[bit << 5 | bit]
+            fp = sum(count for pair, count in counts.items() if pair & 31 == bit and pair >> 5 != bit)
+            fn = sum(count for pair, count in counts.items() if pair >> 5 == bit and pair & 31 != bit)
+            if tp + fp + fn:
+                precisions.append(safe_div(tp, tp + fp))
+                recalls.append(safe_div(tp, tp + fn))
+                f1s.append(safe_div(2 * tp, 2 * tp + fp + fn))
+        return {"precision": safe_div(sum(precisions), len(precisions)), "recall": safe_div(sum(recalls), len(recalls)),
+                "f1": safe_div(sum(f1s), len(f1s))}
+    # sample average, summed exactly so the result does not depend on the row order
+    precision = recall = f1 = Fraction(0)
+    for pair, count in counts.items():
+        true, pred = pair >> 5, pair & 31
+        tp = bin(true & pred).count('1')
+        n_true, n_pred = bin(true).count('1'), bin(pred).count('1')
+        if n_pred:
+            precision += Fraction(count * tp, n_pred)
+        if n_true:
+            recall += Fraction(count * tp, n_true)
+        if n_true + n_pred:
+            f1 += Fraction(count * 2 * tp, n_true + n_pred)
+    return {"precision": float(precision / rows) if rows else 0.0, "recall": float(recall / rows) if rows else 0.0,
+            "f1": float(f1 / rows) if rows else 0.0}
+
+def report_metrics(counts, label_type, rows, invalid, verbose=True):
+    metrics = metrics_from_counts(counts, label_type, rows)
+    if not verbose:
+        return metrics
+    if label_type == 'MULTICLASS':
+        if invalid['truth'] or invalid['response']:
+            print(f"{bcolors.RED}Warning: Invalid responses detected{bcolors.ENDC}")
+            if invalid['truth']:
+                print(f"Invalid truth values: {sorted(invalid['truth'])}")
+            if invalid['response']:
+                print(f"Invalid predicted values: {sorted(invalid['response'])}")
+        print()
+    prefix = {'BINARY': '', 'MULTICLASS': 'macro-', 'MULTILABEL': 'sample-average '}[label_type]
+    print(f"{bcolors.BLUE}{prefix}Precision: {bcolors.ENDC}{metrics['precision']:.2f}")
+    print(f"{bcolors.BLUE}{prefix}Recall: {bcolors.ENDC}{metrics['recall']:.2f}")
+    print(f"{bcolors.BLUE}{prefix}F1-score: {bcolors.ENDC}{metrics['f1']:.2f}")
+    return metrics
+
+def evaluate_multilabel(df, verbose=True):
     """Evaluate multilabel checkbox responses (truth/response columns)"""
-    # Clean and prepare
-    y_true = df['truth'].str.replace(' ', '').str.split(',')
-    y_pred = df['response'].str.replace(' ', '').str.split(',')
-
-    # Convert to binary matrix representation (for sample-average)
-    mlb = MultiLabelBinarizer(classes=['a', 'b', 'c', 'd', 'e'])
-    y_true_bin = mlb.fit_transform(y_true)
-    y_pred_bin = mlb.transform(y_pred)
-
-    # Calculate sample-average metrics
-    precision = precision_score(y_true_bin, y_pred_bin, average='samples', zero_division=0)
-    recall = recall_score(y_true_bin, y_pred_bin, average='samples', zero_division=0)
-    f1 = f1_score(y_true_bin, y_pred_bin, average='samples', zero_division=0)
-
-    # Print results
-    print(f"{bcolors.BLUE}sample-average Precision: {bcolors.ENDC}{precision:.2f}")
-    print(f"{bcolors.BLUE}sample-average Recall: {bcolors.ENDC}{recall:.2f}")
-    print(f"{bcolors.BLUE}sample-average F1-score: {bcolors.ENDC}{f1:.2f}")
-
-def evaluate_binary(df):
-    """Evaluate binary responses (truth/prediction columns)"""
-    # Filter only 'yes'/'no' responses
-    df = df[df['truth'].isin(['yes', 'no']) & df['response'].isin(['yes', 'no'])]
-    # Clean and prepare
-    y_true = df['truth']
-    y_pred = df['response']
-
-    # Calculate metrics
-    precision = precision_score(y_true, y_pred, pos_label='yes', zero_division=0)
-    recall = recall_score(y_true, y_pred, pos_label='yes', zero_division=0)
-    f1 = f1_score(y_true, y_pred, pos_label='yes', zero_division=0)
-
-    # Print results
-    print(f"{bcolors.BLUE}Precision: {bcolors.ENDC}{precision:.2f}")
-    print(f"{bcolors.BLUE}Recall: {bcolors.ENDC}{recall:.2f}")
-    print(f"{bcolors.BLUE}F1-score: {bcolors.ENDC}{f1:.2f}")
-
-def evaluate_multiclass(df):
-    """Evaluate multiple-choice responses (truth/response columns)"""
-    # Clean and prepare
-    y_true = df['truth'].str.strip()
-    y_pred = df['response'].str.strip()
-
-    # Validate possible classes (a-e)
-    valid_classes = {'a', 'b', 'c', 'd', 'e'}
-    invalid_true = ~y_true.isin(valid_classes)
-    invalid_pred = ~y_pred.isin(valid_classes)
-
-    if invalid_true.any() or invalid_pred.any():
-        print(f"{bcolors.RED}Warning: Invalid responses detected{bcolors.ENDC}")
-        if invalid_true.any():
-            print(f"Invalid truth values: {y_true[invalid_true].unique()}")
-        if invalid_pred.any():
-            print(f"Invalid predicted values: {y_pred[invalid_pred].unique()}")
-        
-        # Filter out invalid responses
-        valid_mask = y_true.isin(valid_classes) & y_pred.isin(valid_classes)
-        y_true = y_true[valid_mask]
-        y_pred = y_pred[valid_mask]
-
-    # Calculate macro-averaged metrics
-    precision = precision_score(y_true, y_pred, average='macro', zero_division=0)
-    recall = recall_score(y_true, y_pred, average='macro', zero_division=0)
-    f1 = f1_score(y_true, y_pred, average='macro', zero_division=0)
-
-    # Print results
-    print(f"\n{bcolors.BLUE}macro-Precision: {bcolors.ENDC}{precision:.2f}")
-    print(f"{bcolors.BLUE}macro-Recall: {bcolors.ENDC}{recall:.2f}")
-    print(f"{bcolors.BLUE}macro-F1-score: {bcolors.ENDC}{f1:.2f}")
+    counts, invalid = count_label_pairs(column(df, 'truth'), column(df, 'response'), 'MULTILABEL')
+    return report_metrics(counts, 'MULTILABEL', len(df['truth']), invalid, verbose)
+
+def evaluate_binary(df, verbose=True):
+    """Evaluate binary responses (truth/prediction columns), rows outside yes/no are ignored"""
+    counts, invalid = count_label_pairs(column(df, 'truth'), column(df, 'response'), 'BINARY')
+    return report_metrics(counts, 'BINARY', len(df['truth']), invalid, verbose)
+
+def evaluate_multiclass(df, verbose=True):
+    """Evaluate multiple-choice responses (truth/response columns), rows outside a-e are ignored"""
+    counts, invalid = count_label_pairs(column(df, 'truth'), column(df, 'response'), 'MULTICLASS')
+    return report_metrics(counts, 'MULTICLASS', len(df['truth']), invalid, verbose)
+
+def count_file_label_pairs(path, label_type, chunk_rows=100000):
+    """Stream a response CSV in chunks of rows into a mask pair count table, returns (counts, rows, invalid)"""
+    counts, invalid, rows = Counter(), {'truth': set(), 'response': set()}, 0
+    with open(path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        truth_index, response_index = header.index('truth'), header.index('response')
+        while True:
+            chunk = list(islice(reader, chunk_rows))
+            if not chunk:
+                break
+            rows += len(chunk)
+            count_label_pairs((row[truth_index] for row in chunk), (row[response_index] for row in chunk),
+                              label_type, counts, invalid)
+    return counts, rows, invalid
+
+def evaluate_stream(path, label_type, chunk_rows=100000, verbose=True):
+    """Evaluate a response CSV without loading it, memory stays constant in the number of rows"""
+    counts, rows, invalid = count_file_label_pairs(path, label_type, chunk_rows)
+    return report_metrics(counts, label_type, rows, invalid, verbose)
+
+def read_responses(path):
+    """Load a response CSV as {column: [values]}"""
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        df = {name: [] for name in reader.fieldnames}
+        for row in reader:
+            for name in df:
+                df[name].append(row[name] or "")
+    return df
+
+# Bootstrap (numpy is only imported on this path). Every row contributes a fixed vector of counts, a
+# resample is a vector of row multiplicities, so the statistics of a block of resamples are one matrix product
+
+def row_contributions(df, label_type):
+    """Per-row contributions (n x k) whose column sums determine the metrics of label_type"""
+    import numpy as np
+    classes = ['a', 'b', 'c', 'd', 'e']
+    if label_type == 'BINARY':
+        # tp, fp, fn (rows outside yes/no contribute nothing)
+        contributions = [
+            (true == 'yes' and pred == 'yes', true == 'no' and pred == 'yes', true == 'yes' and pred == 'no')
+            if true in ('yes', 'no') and pred in ('yes', 'no') else (0, 0, 0)
+            for true, pred in zip(column(df, 'truth'), column(df, 'response'))
+        ]
+    elif label_type == 'MULTICLASS':
+        # tp, fp, fn per class
+        contributions = []
+        for true, pred in zip(column(df, 'truth'), column(df, 'response')):
+            true, pred = true.strip(), pred.strip()
+            valid = true in classes and pred in classes
+            row = []
+            for label in classes:
+                row += [valid and true == label and pred == label,
+                        valid and true != label and pred == label,
+                        valid and true == label and pred != label]
+            contributions.append(row)
+    else:
+        # per-sample precision, recall, f1 and a row count
+        contributions = []
+        for truth, response in zip(column(df, 'truth'), column(df, 'response')):
+            true = set(truth.replace(' ', '').split(',')) & set(classes)
+            pred = set(response.replace(' ', '').split(',')) & set(classes)
+            tp = len(true & pred)
+            contributions.append((safe_div(tp, len(pred)), safe_div(tp, len(true)), safe_div(2 * tp, len(true) + len(pred)), 1))
+    return np.asarray(contributions, dtype=np.float64).reshape(len(contributions), -1)
+
+def metrics_from_sums(sums, label_type):
+    """(precision, recall, f1) columns from summed contributions (one row per resample)"""
+    import numpy as np
+    def divide(numerator, denominator):
+        return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+    if label_type == 'BINARY':
+        tp, fp, fn = sums[:, 0], sums[:, 1], sums[:, 2]
+        return np.stack([divide(tp, tp + fp), divide(tp, tp + fn), divide(2 * tp, 2 * tp + fp + fn)], axis=1)
+    if label_type == 'MULTICLASS':
+        counts = sums.reshape(len(sums), -1, 3)
+        tp, fp, fn = counts[:, :, 0], counts[:, :, 1], counts[:, :, 2]
+        # macro average over the labels present in the resample
+        present = (tp + fp + fn) > 0
+        n_present = present.sum(axis=1).astype(np.float64)
+        per_label = [divide(tp, tp + fp), divide(tp, tp + fn), divide(2 * tp, 2 * tp + fp + fn)]
+        return np.stack([divide((metric * present).sum(axis=1), n_present) for metric in per_label], axis=1)
+    return np.stack([divide(sums[:, i], sums[:, 3]) for i in range(3)], axis=1)
+
+def bootstrap_weights(rng, n, resamples, block_size=1000):
+    """Row multiplicities of the resamples, built from a (block x n) resample index matrix per block"""
+    import numpy as np
+    for start in range(0, resamples, block_size):
+        block = min(block_size, resamples - start)
+        indices = rng.integers(0, n, size=(block, n)) + (np.arange(block) * n)[:, None]
+        yield np.bincount(indices.ravel(), minlength=block * n).reshape(block, n).astype(np.float64)
+
+def bootstrap_metrics(df, label_type, resamples=1000, confidence=0.95, seed=None):
+    """Percentile confidence intervals of precision/recall/f1, {metric_low: ..., metric_high: ...}"""
+    import numpy as np
+    contributions = row_contributions(df, label_type)
+    rng = np.random.default_rng(seed)
+    samples = np.concatenate([
+        metrics_from_sums(weights @ contributions, label_type)
+        for weights in bootstrap_weights(rng, len(contributions), resamples)
+    ])
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha], axis=0)
+    intervals = {}
+    for i, metric in enumerate(["precision", "recall", "f1"]):
+        intervals[f"{metric}_low"] = float(low[i])
+        intervals[f"{metric}_high"] = float(high[i])
+    return intervals
+
+def align_queries(df_a, df_b):
+    """Restrict two response tables to their common queries, in the same order"""
+    if df_a['query'] == df_b['query']:
+        return df_a, df_b
+    rows_b = {}
+    for i, query in enumerate(df_b['query']):
+        rows_b.setdefault(query, i)
+    pairs = [(i, rows_b[query]) for i, query in enumerate(df_a['query']) if query in rows_b]
+    subset = lambda df, rows: {name: [values[row] for row in rows] for name, values in df.items()}
+    return subset(df_a, [i for i, _ in pairs]), subset(df_b, [j for _, j in pairs])
+
+def paired_bootstrap(df_a, df_b, label_type, resamples=1000, confidence=0.95, seed=None):
+    """
+    Paired bootstrap of the metric differences (a - b) on the same queries: the same resamples are applied
+    to both models. Returns the differences, their intervals and two-sided p-values
+    """
+    import numpy as np
+    df_a, df_b = align_queries(df_a, df_b)
+    contributions_a = row_contributions(df_a, label_type)
+    contributions_b = row_contributions(df_b, label_type)
+    rng = np.random.default_rng(seed)
+    differences = np.concatenate([
+        metrics_from_sums(weights @ contributions_a, label_type) - metrics_from_sums(weights @ contributions_b, label_type)
+        for weights in bootstrap_weights(rng, len(contributions_a), resamples)
+    ])
+    observed = metrics_from_sums(contributions_a.sum(axis=0)[None], label_type)[0] - \
+        metrics_from_sums(contributions_b.sum(axis=0)[None], label_type)[0]
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(differences, [alpha, 1 - alpha], axis=0)
+    p_values = np.minimum(1.0, 2 * np.minimum((differences <= 0).mean(axis=0), (differences >= 0).mean(axis=0)))
+    result = {"rows": len(contributions_a)}
+    for i, metric in enumerate(["precision", "recall", "f1"]):
+        result[f"{metric}_diff"] = float(observed[i])
+        result[f"{metric}_diff_low"] = float(low[i])
+        result[f"{metric}_diff_high"] = float(high[i])
+        result[f"{metric}_p_value"] = float(p_values[i])
+    return result
+
+# task -> (label type, evaluator of its {column: values} table); -dir evaluates the <task>_responses_<model>.csv
+# files of every task registered here
+EVALUATORS = {
+    'yesno': ('BINARY', evaluate_binary),
+    'radio': ('MULTICLASS', evaluate_multiclass),
+    'checkbox': ('MULTILABEL', evaluate_multilabel),
+}
+
+RESPONSE_FILE_PATTERN = re.compile(r'^(.+?)_responses_(.+)\.csv$')
+
+def find_response_files(directory):
+    """(model, task, path) of every response file of a registered task in a directory"""
+    files = []
+    for name in sorted(os.listdir(directory)):
+        match = RESPONSE_FILE_PATTERN.match(name)
+        if match and match.group(1) in EVALUATORS:
+            files.append((match.group(2), match.group(1), os.path.join(directory, name)))
+    return files
+
+def evaluate_file(model, task, path, resamples=0, confidence=0.95, seed=None):
+    label_type, evaluator = EVALUATORS[task]
+    df = read_responses(path)
+    metrics = evaluator(df, verbose=False)
+    if resamples > 0:
+        metrics.update(bootstrap_metrics(df, label_type, resamples, confidence, seed))
+    return {"model": model, "task": task, "label_type": label_type, "rows": len(df['truth']), **metrics}
+
+def evaluate_directory(directory, resamples=0, confidence=0.95, seed=None):
+    """Evaluate every response file of a directory, one result row per model and task"""
+    return [evaluate_file(model, task, path, resamples, confidence, seed) for model, task, path in find_response_files(directory)]
+
+def compare_directory(directory, resamples=1000, confidence=0.95, seed=None):
+    """Paired bootstrap tests between every pair of models on each task"""
+    by_task = {}
+    for model, task, path in find_response_files(directory):
+        by_task.setdefault(task, []).append((model, read_responses(path)))
+    comparisons = []
+    for task, models in by_task.items():
+        for i, (model_a, df_a) in enumerate(models):
+            for model_b, df_b in models[i + 1:]:
+                result = paired_bootstrap(df_a, df_b, EVALUATORS[task][0], resamples, confidence, seed)
+                comparisons.append({"task": task, "model_a": model_a, "model_b": model_b, **result})
+    return comparisons
+
+def write_table(rows, output_path, keys=()):
+    """Write flat records as CSV (one row each) or JSON; with keys, the JSON nests every record under its key values"""
+    if output_path.endswith('.json'):
+        table = rows
+        if keys:
+            table = {}
+            for row in rows:
+                node = table
+                for key in keys[:-1]:
+                    node = node.setdefault(row[key], {})
+                node[row[keys[-1]]] = {name: value for name, value in row.items() if name not in keys}
+        with open(output_path, "w") as f:
+            json.dump(table, f, indent=2)
+    else:
+        with open(output_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else list(keys) or ["task"], lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
+
+def write_results(results, output_path):
+    """Write the results table as JSON ({model: {task: metrics}}) or CSV (one row per model and task)"""
+    write_table(results, output_path, keys=('model', 'task'))
+
+def print_comparisons(comparisons):
+    for comparison in comparisons:
+        print(f"{bcolors.BLUE}{comparison['task']}: {comparison['model_a']} - {comparison['model_b']}{bcolors.ENDC} "
+              f"F1 diff {comparison['f1_diff']:+.3f} [{comparison['f1_diff_low']:+.3f}, {comparison['f1_diff_high']:+.3f}], "
+              f"p={comparison['f1_p_value']:.3f}")
+
+def print_results(results):
+    """Model x task table of precision/recall/F1"""
+    tasks = [task for task in EVALUATORS if any(result['task'] == task for result in results)]
+    models = sorted({result['model'] for result in results})
+    by_key = {(result['model'], result['task']): result for result in results}
+    width = max([len(model) for model in models] + [5])
+    print(f"{bcolors.BLUE}{'model':<{width}}{bcolors.ENDC}" + "".join(f"  {bcolors.BLUE}{task + ' P/R/F1':<20}{bcolors.ENDC}" for task in tasks))
+    for model in models:
+        cells = []
+        for task in tasks:
+            result = by_key.get((model, task))
+            cells.append(f"{result['precision']:.2f}/{result['recall']:.2f}/{result['f1']:.2f}" if result else "-")
+        print(f"{model:<{width}}" + "".join(f"  {cell:<20}" for cell in cells))
+        # F1 confidence intervals, if bootstrapped
+        if any(result and 'f1_low' in result for result in (by_key.get((model, task)) for task in tasks)):
+            intervals = []
+            for task in tasks:
+                result = by_key.get((model, task))
+                intervals.append(f"F1 [{result['f1_low']:.2f}, {result['f1_high']:.2f}]" if result else "-")
+            print(f"{'':<{width}}" + "".join(f"  {interval:<20}" for interval in intervals))
 
 def main():
     # Parse arguments
     parser = argparse.ArgumentParser(description="Evaluate responses based on type.")
-    parser.add_argument("-response_path", type=str, required=True, help="Path to CSV with response data")
-    parser.add_argument("-label_type", type=str, required=True, 
-                        choices=['BINARY', 'MULTICLASS', 'MULTILABEL'], 
+    parser.add_argument("-response_path", type=str, help="Path to CSV with response data")
+    parser.add_argument("-label_type", type=str,
+                        choices=['BINARY', 'MULTICLASS', 'MULTILABEL'],
                         help="Type of evaluation to perform")
+    parser.add_argument("-dir", type=str, help="Evaluate every <yesno|radio|checkbox>_responses_<model>.csv file of a directory")
+    parser.add_argument("-output", type=str, help="With -dir, write the results table to this .csv or .json file")
+    parser.add_argument("-bootstrap", type=int, default=0, help="Number of bootstrap resamples for confidence intervals (0 disables them)")
+    parser.add_argument("-confidence", type=float, default=0.95, help="Confidence level of the bootstrap intervals")
+    parser.add_argument("-seed", type=int, default=None, help="Random seed of the bootstrap")
+    parser.add_argument("-compare_output", type=str, help="With -dir and -bootstrap, run paired bootstrap tests between all models of a task and write them to this .csv or .json file")
+    parser.add_argument("-chunk_rows", type=int, default=100000, help="With -response_path, rows read at a time: the file is streamed so memory does not grow with its size")
+    parser.add_argument("-profile_startup", action="store_true", help="Print import, load and evaluation times")
     args = parser.parse_args()
+    imported = time.perf_counter()
 
-    # Load data
-    df = pd.read_csv(args.response_path)
+    if args.dir:
+        results = evaluate_directory(args.dir, args.bootstrap, args.confidence, args.seed)
+        print_results(results)
+        if args.output:
+            write_results(results, args.output)
+        if args.bootstrap > 0 and args.compare_output:
+            comparisons = compare_directory(args.dir, args.bootstrap, args.confidence, args.seed)
+            print_comparisons(comparisons)
+            write_table(comparisons, args.compare_output)
+        if args.profile_startup:
+            print(f"startup: {(imported - STARTUP) * 1000:.1f} ms, evaluate: {(time.perf_counter() - imported) * 1000:.1f} ms")
+        return
+    if not args.response_path or not args.label_type:
+        parser.error("-response_path and -label_type are required unless -dir is given")
 
-    # Call appropriate evaluation function
-    if args.label_type == 'MULTILABEL':
-        evaluate_multilabel(df)
-    elif args.label_type == 'BINARY':
-        evaluate_binary(df)
-    elif args.label_type == 'MULTICLASS':
-        evaluate_multiclass(df)
-    else:
+    if args.label_type not in ENCODERS:
         raise ValueError(f"Unknown label type: {args.label_type}")
+    # Stream the file through the evaluator, only the bootstrap loads it
+    counts, rows, invalid = count_file_label_pairs(args.response_path, args.label_type, args.chunk_rows)
+    loaded = time.perf_counter()
+    report_metrics(counts, args.label_type, rows, invalid)
+    if args.bootstrap > 0:
+        intervals = bootstrap_metrics(read_responses(args.response_path), args.label_type, args.bootstrap, args.confidence, args.seed)
+        for metric in ["precision", "recall", "f1"]:
+            print(f"{bcolors.BLUE}{metric} {args.confidence:.0%} CI: {bcolors.ENDC}"
+                  f"[{intervals[metric + '_low']:.2f}, {intervals[metric + '_high']:.2f}]")
+
+    if args.profile_startup:
+        done = time.perf_counter()
+        print(f"startup: {(imported - STARTUP) * 1000:.1f} ms, load: {(loaded - imported) * 1000:.1f} ms, "
+              f"evaluate: {(done - loaded) * 1000:.1f} ms")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,7 +1,15 @@
 import re
+import os
+import csv
+import json
 import random
+import hashlib
 import argparse
-from typing import List, Tuple
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 
 INVERSE_RELATION = {
@@ -35,52 +43,292 @@ relation_pool = ["north of", "south of", "east of", "west of",
 
 POS_TO_LETTER = {0:"a.", 1:"b.", 2:"c.", 3:"d."}
 
-ENTITY_MAP = {}
-    
+class StringTable:
+    """Read-only list of strings stored as concatenated UTF-8 bytes plus offsets (memory-mappable)"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @staticmethod
+    def encode(strings: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
 
-def parse_nt_file(file_path: str) -> List[Tuple[str, str, str]]:
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        return self.data[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+class EntityIndex:
+    """
+    Graph of interned entity/relation ids in CSR form. The triples are grouped by (subject, relation):
+    group g holds the objects objects[group_offsets[g]:group_offsets[g + 1]] of relation group_relations[g],
+    and subject s owns the groups subject_offsets[s]:subject_offsets[s + 1]
+    """
+
+    def __init__(self):
+        self.entities = []
+        self.entity_ids = {}
+        self.relations = []
+        self.relation_ids = {}
+        # flat (subject, relation, object) ids, until finalize() builds the CSR arrays
+        self.edges = array('i')
+        self.objects = np.empty(0, dtype=np.int32)
+        self.group_offsets = np.zeros(1, dtype=np.int64)
+        self.group_relations = np.empty(0, dtype=np.int32)
+        self.subject_offsets = np.zeros(1, dtype=np.int64)
+
+    def intern_entity(self, name: str) -> int:
+        entity_id = self.entity_ids.get(name)
+        if entity_id is None:
+            entity_id = self.entity_ids[name] = len(self.entities)
+            self.entities.append(name)
+        return entity_id
+
+    def intern_relation(self, name: str) -> int:
+        relation_id = self.relation_ids.get(name)
+        if relation_id is None:
+            relation_id = self.relation_ids[name] = len(self.relations)
+            self.relations.append(name)
+        return relation_id
+
+    def add(self, triple: Tuple[str, str, str]):
+        subj, pred, obj = triple
+        self.edges.extend((self.intern_entity(subj), self.intern_relation(pred), self.intern_entity(obj)))
+
+    def finalize(self):
+        """Sort the edges by (subject, relation) and build the offset arrays"""
+        edges = np.frombuffer(self.edges, dtype=np.intc).reshape(-1, 3)
+        # stable sort, objects keep their file order within a group
+        order = np.lexsort((edges[:, 1], edges[:, 0]))
+        subjects, relations = edges[order, 0], edges[order, 1]
+        self.objects = edges[order, 2].astype(np.int32)
+
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (subjects[1:] != subjects[:-1]) | (relations[1:] != relations[:-1])
+        group_starts = np.flatnonzero(new_group)
+        self.group_offsets = np.append(group_starts, len(order)).astype(np.int64)
+        self.group_relations = relations[group_starts].astype(np.int32)
+        self.subject_offsets = np.searchsorted(subjects[group_starts], np.arange(len(self.entities) + 1)).astype(np.int64)
+        self.edges = array('i')
+
+    def save(self, cache_dir: str, fingerprint: dict):
+        """Write the index as .npy arrays; meta.json is written last and marks the cache as complete"""
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        entity_bytes, entity_offsets = StringTable.encode([self.entities[i] for i in range(len(self.entities))])
+        arrays = {
+            "objects": self.objects,
+            "group_offsets": self.group_offsets,
+            "group_relations": self.group_relations,
+            "subject_offsets": self.subject_offsets,
+            "entity_bytes": entity_bytes,
+            "entity_offsets": entity_offsets,
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(cache_dir, name + ".npy"), values)
+        with open(meta_path, "w") as f:
+            json.dump({"source": fingerprint, "relations": self.relations}, f)
+
+    @classmethod
+    def load(cls, cache_dir: str, fingerprint: dict) -> Optional["EntityIndex"]:
+        """Memory-map a saved index, None if it is missing or was built from a different source file"""
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta["source"] != fingerprint:
+            return None
+        arrays = {
+            name: np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode='r')
+            for name in ["objects", "group_offsets", "group_relations", "subject_offsets", "entity_bytes", "entity_offsets"]
+        }
+        index = cls()
+        index.relations = meta["relations"]
+        index.relation_ids = {relation: i for i, relation in enumerate(index.relations)}
+        # names are decoded on access, subject ids are registered as triples get sampled
+        index.entities = StringTable(arrays["entity_bytes"], arrays["entity_offsets"])
+        index.objects = arrays["objects"]
+        index.group_offsets = arrays["group_offsets"]
+        index.group_relations = arrays["group_relations"]
+        index.subject_offsets = arrays["subject_offsets"]
+        return index
+
+    def num_triples(self) -> int:
+        return len(self.objects)
+
+    def sample_triples(self, k: int) -> List[Tuple[str, str, str]]:
+        """k distinct triples drawn uniformly, in random order"""
+        edges = np.array(random.sample(range(self.num_triples()), min(k, self.num_triples())), dtype=np.int64)
+        groups = np.searchsorted(self.group_offsets, edges, side='right') - 1
+        subjects = np.searchsorted(self.subject_offsets, groups, side='right') - 1
+        triples = []
+        for edge, group, subject in zip(edges, groups, subjects):
+            subj = self.entities[subject]
+            self.entity_ids[subj] = int(subject)
+            triples.append((subj, self.relations[self.group_relations[group]], self.entities[self.objects[edge]]))
+        return triples
+
+    def subject_groups(self, subj: str) -> Tuple[int, int]:
+        """Range of the (subject, relation) groups of an entity"""
+        subject_id = self.entity_ids[subj]
+        return int(self.subject_offsets[subject_id]), int(self.subject_offsets[subject_id + 1])
+
+    def group_size(self, group: int) -> int:
+        return int(self.group_offsets[group + 1] - self.group_offsets[group])
+
+    def sample_objects(self, group: int, k: int) -> List[str]:
+        """k distinct objects of a group, O(k)"""
+        start = int(self.group_offsets[group])
+        indices = random.sample(range(start, start + self.group_size(group)), k)
+        return [self.entities[self.objects[index]] for index in indices]
+
+    def count_other_objects(self, group: int, first_group: int, last_group: int) -> int:
+        """Number of objects in the other groups of the same subject"""
+        return int(self.group_offsets[last_group] - self.group_offsets[first_group]) - self.group_size(group)
+
+    def sample_other_objects(self, group: int, first_group: int, last_group: int, k: int) -> List[str]:
+        """k objects from the other groups of the same subject (the range around the group), O(k)"""
+        start, end = int(self.group_offsets[first_group]), int(self.group_offsets[last_group])
+        group_start, size = int(self.group_offsets[group]), self.group_size(group)
+        indices = []
+        for index in random.sample(range(end - start - size), k):
+            index += start
+            # skip over the group itself
+            indices.append(index if index < group_start else index + size)
+        return [self.entities[self.objects[index]] for index in indices]
+
+ENTITY_INDEX = EntityIndex()
+
+
+# one compiled pattern validates a line and extracts subject, predicate and object
+TRIPLE_PATTERN = re.compile(r'^<http://spatex\.org/([^>]*)> <http://spatex\.org/([^>]*)> <http://spatex\.org/([^>]*)> \.$')
+
+def parse_nt_line(line: str) -> Optional[Tuple[str, str, str]]:
+    """Parse one N-Triples line into a (subject, predicate, object) triple without URIs"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None  # skip empty lines and comments
+    match = TRIPLE_PATTERN.match(line)
+    if not match:
+        print(f"Skipping malformed line: {line}")
+        return None
+    subj, pred, obj = (group.replace('_', ' ') for group in match.groups())
+    if obj.endswith("."):
+        obj = obj[:-1]
+    return subj, pred, obj
+
+def split_nt_file(file_path: str, chunk_bytes: int) -> List[Tuple[int, int]]:
+    """Split a file into (start, end) byte ranges of about chunk_bytes that end at line boundaries"""
+    size = os.path.getsize(file_path)
+    chunks = []
+    with open(file_path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def parse_nt_chunk(task: Tuple[str, int, int]) -> List[Tuple[str, str, str]]:
+    """Parse the lines in a byte range of an N-Triples file"""
+    file_path, start, end = task
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start).decode('utf-8')
+    triples = []
+    # only \n ends a line, str.splitlines would also split on \x0b, \x1c-\x1e, \x85 or \u2028 inside a literal
+    for line in data.split("\n"):
+        triple = parse_nt_line(line)
+        if triple is not None:
+            triples.append(triple)
+    return triples
+
+def iter_nt_triples(file_path: str, workers: int = 1, chunk_bytes: int = 64 * 1024 * 1024) -> Iterator[Tuple[str, str, str]]:
+    """
+    Stream the triples of an N-Triples file in file order, parsing chunks in a pool of worker processes
+    """
+    tasks = [(file_path, start, end) for start, end in split_nt_file(file_path, chunk_bytes)]
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield from parse_nt_chunk(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # keep a bounded window of chunks in flight so memory does not grow with the file
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(parse_nt_chunk, task))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def parse_nt_file(file_path: str, workers: int = 1) -> List[Tuple[str, str, str]]:
     """
     Parse an N-Triples file and extract subject, predicate, object triples without URIs
     """
     triples = []
-    uri_pattern = re.compile(r'<http://spatex.org/(.*?)>')
-
-
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue  # skip empty lines and comments
-                
-            # Match the triple pattern
-            match = re.match(r'^<.+?> <.+?> <.+?> \.$', line)
-            if not match:
-                print(f"Skipping malformed line: {line}")
-                continue
-                
-            # Extract components
-            try:
-                subj = uri_pattern.search(line).group(1).replace('_', ' ')
-                pred = uri_pattern.search(line.split()[1]).group(1).replace('_', ' ')
-                obj = uri_pattern.search(line.split()[2]).group(1).replace('_', ' ')
-                if obj[-1] == ".":
-                    obj = obj[:-1]
-                triples.append((subj, pred, obj))
-                
-                # add to entity map
-                if subj in ENTITY_MAP:
-                    if pred in ENTITY_MAP[subj]:
-                        ENTITY_MAP[subj][pred].append(obj)
-                    else:
-                        ENTITY_MAP[subj][pred] = [obj]
-                else:
-                    ENTITY_MAP[subj] = {pred:[obj]}
-                    
-            except Exception as e:
-                print(f"Error parsing line: {line}\nError: {e}")
-    
+    for triple in iter_nt_triples(file_path, workers):
+        triples.append(triple)
+        # add to entity index
+        ENTITY_INDEX.add(triple)
+    ENTITY_INDEX.finalize()
     return triples
 
+def file_fingerprint(file_path: str, probe_bytes: int = 1024 * 1024) -> dict:
+    """Size, mtime and a hash of the head and tail of a file, cheap even for very large inputs"""
+    stat = os.stat(file_path)
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(probe_bytes))
+        if stat.st_size > probe_bytes:
+            f.seek(max(stat.st_size - probe_bytes, probe_bytes))
+            digest.update(f.read())
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+def load_entity_index(file_path: str, workers: int = 1, cache_dir: Optional[str] = None) -> EntityIndex:
+    """
+    Build the entity index of an N-Triples file, or memory-map it from cache_dir if it was already
+    built from the same file (the cache is rebuilt when the file changes)
+    """
+    global ENTITY_INDEX
+    fingerprint = file_fingerprint(file_path) if cache_dir else None
+    index = EntityIndex.load(cache_dir, fingerprint) if cache_dir else None
+    if index is None:
+        index = EntityIndex()
+        for triple in iter_nt_triples(file_path, workers):
+            index.add(triple)
+        index.finalize()
+        if cache_dir:
+            index.save(cache_dir, fingerprint)
+    else:
+        print(f"Loaded parsed graph from {cache_dir}")
+    ENTITY_INDEX = index
+    return index
+
+def format_radio_question(subj: str, obj: str, options: List[str]) -> str:
+    return (
+        f"Question: Select exactly one option (a-e) that best describes the relationship of {subj} in relation to {obj} in terms of geography. "
+        f"Options: a. {options[0]} b. {options[1]} c. {options[2]} d. {options[3]} e. {options[4]}"
+    )
+
+def format_checkbox_question(subj: str, relation: str, labeled_options: List[Tuple[str, str]]) -> str:
+    options = " ".join([f"{label}. {option}" for label, option in labeled_options])
+    if "intersects" in relation:
+        return f"Question: Select all options that intersect with {subj}? You may choose one or more options. Options: " + options
+    elif "contains" in relation:
+        return f"Question: Select all options that are inside of {subj}? You may choose one or more options. Options: " + options
+    return f"Question: Select all options that are {relation} {subj}? You may choose one or more options. Options: " + options
+
 def generate_yesno_question(triple: Tuple[str, str, str]) -> str:
     """Generate a yes/no question from a triple"""
     subj, pred, obj = triple
@@ -134,10 +382,7 @@ def generate_radio_question(triple: Tuple[str, str, str]) -> str:
         options = options + ["none of the above"]
     
     # Build query (options a-e)
-    question = (
-        f"Question: Select exactly one option (a-e) that best describes the relationship of {subj} in relation to {obj} in terms of geography. "
-        f"Options: a. {options[0]} b. {options[1]} c. {options[2]} d. {options[3]} e. {options[4]}"
-    )
+    question = format_radio_question(subj, obj, options)
     
     # print(f"subj: {subj}, pred: {pred}, obj: {obj}")
     # print(f"question: {question}, truth: {truth}")
@@ -148,35 +393,25 @@ def generate_checkbox_question(triple: Tuple[str, str, str], total_options: int
     subj, pred, obj = triple
     
     # get one random relation tied to the primary entity
-    random_relation = random.choice(list(ENTITY_MAP[subj].keys()))
-    selection = ENTITY_MAP[subj][random_relation]
+    first_group, last_group = ENTITY_INDEX.subject_groups(subj)
+    group = random.randrange(first_group, last_group)
+    random_relation = ENTITY_INDEX.relations[ENTITY_INDEX.group_relations[group]]
 
     # pick random correct options from the available ones
-    total_correct_answers = random.randint(0, min(total_options, len(selection)))
-    correct_answers = random.sample(selection, total_correct_answers)
+    total_correct_answers = random.randint(0, min(total_options, ENTITY_INDEX.group_size(group)))
+    correct_answers = ENTITY_INDEX.sample_objects(group, total_correct_answers)
     
     options = correct_answers.copy()
         
     # generate wrong choices from the rest of the relations related to the entity
     total_wrong_answers = total_options - total_correct_answers
     if total_wrong_answers > 0:
-        # Collect all entities from other relations
-        other_relations = [
-            rel for rel in ENTITY_MAP[subj] if rel != random_relation
-        ]
-
-        # Flatten all entities from other relations
-        wrong_candidates = []
-        for rel in other_relations:
-            wrong_candidates.extend(ENTITY_MAP[subj][rel])
-
         # Ensure we have enough to sample
-        if len(wrong_candidates) < total_wrong_answers:
-            print("Warning: Not enough wrong candidates. Exiting...")
+        if ENTITY_INDEX.count_other_objects(group, first_group, last_group) < total_wrong_answers:
             # todo: generate random
-            exit(-1)
+            raise ValueError(f"Not enough wrong candidates for a checkbox question about {subj}")
         else:
-            wrong_answers = random.sample(wrong_candidates, total_wrong_answers)
+            wrong_answers = ENTITY_INDEX.sample_other_objects(group, first_group, last_group, total_wrong_answers)
 
         # append the wrong options 
         options += wrong_answers
@@ -199,21 +434,195 @@ def generate_checkbox_question(triple: Tuple[str, str, str], total_options: int
         truth = "e"
         
     # generate query
-    question = ""        
-    if "intersects" in random_relation:
-        question = f"Question: Select all options that intersect with {subj}? You may choose one or more options. Options: " + \
-                " ".join([f"{label}. {option}" for label, option in labeled_options])
-    elif "contains" in random_relation:
-        question = f"Question: Select all options that are inside of {subj}? You may choose one or more options. Options: " + \
-                " ".join([f"{label}. {option}" for label, option in labeled_options])
-    else:
-        question = f"Question: Select all options that are {random_relation} {subj}? You may choose one or more options. Options: " + \
-                " ".join([f"{label}. {option}" for label, option in labeled_options])
+    question = format_checkbox_question(subj, random_relation, labeled_options)
         
     # print(f"subj: {subj}, pred: {pred}, obj: {obj}")
     # print(f"question: {question}, truth: {truth}")
     return question, truth
 
+def floyd_sample(rng: np.random.Generator, sizes: np.ndarray, counts: np.ndarray, max_count: int = 4) -> np.ndarray:
+    """
+    Per row, counts[i] distinct indices in [0, sizes[i]) with Floyd's algorithm, vectorized over the rows
+    (max_count draws whatever the sizes). Unused slots are -1
+    """
+    picks = np.full((len(sizes), max_count), -1, dtype=np.int64)
+    for step in range(max_count):
+        active = step < counts
+        j = np.maximum(sizes - counts + step, 0)
+        candidate = rng.integers(0, j + 1)
+        taken = (picks == candidate[:, None]).any(axis=1)
+        picks[:, step] = np.where(active, np.where(taken, j, candidate), -1)
+    return picks
+
+def sample_triple_ids(index: EntityIndex, rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Draw n triples (with replacement), returns their edge, group and subject ids"""
+    edges = rng.integers(0, index.num_triples(), size=n)
+    groups = np.searchsorted(index.group_offsets, edges, side='right') - 1
+    subjects = np.searchsorted(index.subject_offsets, groups, side='right') - 1
+    return edges, groups, subjects
+
+def bulk_yesno_questions(index: EntityIndex, rng: np.random.Generator, n: int) -> List[Tuple[str, str, str]]:
+    edges, groups, subjects = sample_triple_ids(index, rng, n)
+    yes = rng.integers(0, 2, size=n) == 0
+    questions = []
+    for edge, group, subject, is_yes in zip(edges, groups, subjects, yes):
+        pred = index.relations[index.group_relations[group]]
+        # relations without an inverse (e.g. intersects) can only be asked as yes questions
+        if is_yes or pred not in INVERSE_RELATION:
+            questions.append(("yes/no", f"Is {index.entities[subject]} {pred} of {index.entities[index.objects[edge]]}?", "yes"))
+        else:
+            questions.append(("yes/no", f"Is {index.entities[subject]} {INVERSE_RELATION[pred]} of {index.entities[index.objects[edge]]}?", "no"))
+    return questions
+
+def bulk_radio_questions(index: EntityIndex, rng: np.random.Generator, n: int) -> List[Tuple[str, str, str]]:
+    edges, groups, subjects = sample_triple_ids(index, rng, n)
+    is_none_correct = rng.random(n) < 0.2
+    # 4 distinct distractors per question: the smallest random keys, the predicate itself excluded from the pool
+    pool_position = {relation: i for i, relation in enumerate(relation_pool)}
+    pred_positions = np.array([pool_position.get(index.relations[relation], -1) for relation in index.group_relations[groups]], dtype=np.int64)
+    keys = rng.random((n, len(relation_pool)))
+    rows = np.flatnonzero(pred_positions >= 0)
+    keys[rows, pred_positions[rows]] = np.inf
+    distractors = np.argsort(keys, axis=1)[:, :4]
+    # the correct answer goes to a random position among the first 3 distractors
+    positions = rng.integers(0, 4, size=n)
+
+    questions = []
+    for i in range(n):
+        subj, obj = index.entities[subjects[i]], index.entities[index.objects[edges[i]]]
+        pred = index.relations[index.group_relations[groups[i]]]
+        if is_none_correct[i]:
+            options = [relation_pool[d] for d in distractors[i]] + ["none of the above"]
+            truth = "e."
+        else:
+            options = [relation_pool[d] for d in distractors[i, :3]]
+            options.insert(positions[i], pred)
+            options.append("none of the above")
+            truth = POS_TO_LETTER[positions[i]]
+        questions.append(("radio", format_radio_question(subj, obj, options), truth))
+    return questions
+
+def bulk_checkbox_questions(index: EntityIndex, rng: np.random.Generator, n: int, total_options: int = 4) -> List[Tuple[str, str, str]]:
+    # a subject with fewer than total_options objects cannot fill the options, its rows are drawn again
+    subject_sizes = np.diff(index.group_offsets[index.subject_offsets])
+    if not (subject_sizes >= total_options).any():
+        raise ValueError(f"No subject has the {total_options} objects a checkbox question needs")
+    subjects = np.empty(0, dtype=np.int64)
+    while len(subjects) < n:
+        _, _, drawn = sample_triple_ids(index, rng, n - len(subjects))
+        subjects = np.concatenate([subjects, drawn[subject_sizes[drawn] >= total_options]])
+    first_groups, last_groups = index.subject_offsets[subjects], index.subject_offsets[subjects + 1]
+    # one random relation of the subject
+    groups = rng.integers(first_groups, last_groups)
+    group_starts = index.group_offsets[groups]
+    sizes = index.group_offsets[groups + 1] - group_starts
+    subject_starts = index.group_offsets[first_groups]
+    others = index.group_offsets[last_groups] - subject_starts - sizes
+    # correct answers, raised where the other relations cannot fill the remaining options
+    max_correct = np.minimum(total_options, sizes)
+    correct = np.clip(rng.integers(0, max_correct + 1), total_options - others, max_correct)
+    correct_picks = floyd_sample(rng, sizes, correct, total_options)
+    wrong_picks = floyd_sample(rng, others, total_options - correct, total_options)
+    correct_objects = np.where(correct_picks >= 0, group_starts[:, None] + correct_picks, -1)
+    # wrong answers come from the subject's range around the chosen group
+    wrong_objects = subject_starts[:, None] + wrong_picks
+    wrong_objects = np.where(wrong_objects >= group_starts[:, None], wrong_objects + sizes[:, None], wrong_objects)
+
+    # [correct..., wrong...] per row, then shuffled
+    columns = np.arange(total_options)
+    is_correct = columns[None, :] < correct[:, None]
+    wrong_columns = np.clip(columns[None, :] - correct[:, None], 0, total_options - 1)
+    options = np.where(is_correct, correct_objects[:, :total_options], np.take_along_axis(wrong_objects, wrong_columns, axis=1))
+    order = np.argsort(rng.random((n, total_options)), axis=1)
+    options = np.take_along_axis(options, order, axis=1)
+    is_correct = np.take_along_axis(is_correct, order, axis=1)
+
+    option_letters = ['a', 'b', 'c', 'd']
+    questions = []
+    for i in range(n):
+        subj = index.entities[subjects[i]]
+        relation = index.relations[index.group_relations[groups[i]]]
+        labeled_options = [(option_letters[j], index.entities[index.objects[options[i, j]]]) for j in range(total_options)]
+        labeled_options.append(('e', 'None of the above'))
+        truth = ",".join(option_letters[j] for j in range(total_options) if is_correct[i, j]) or "e"
+        questions.append(("checkbox", format_checkbox_question(subj, relation, labeled_options), truth))
+    return questions
+
+BULK_GENERATORS = {"yes/no": bulk_yesno_questions, "radio": bulk_radio_questions, "checkbox": bulk_checkbox_questions}
+
+def generate_question_chunk(task: Tuple[List[Tuple[str, int]], np.random.SeedSequence]) -> List[Tuple[str, str, str]]:
+    """Generate one chunk of questions, (type, count) parts in order, from its own seed"""
+    parts, seed_sequence = task
+    rng = np.random.default_rng(seed_sequence)
+    questions = []
+    for qtype, count in parts:
+        questions += BULK_GENERATORS[qtype](ENTITY_INDEX, rng, count)
+    return questions
+
+def init_bulk_worker(file_path: str, cache_dir: str):
+    load_entity_index(file_path, 1, cache_dir)
+
+def plan_chunks(counts: List[Tuple[str, int]], chunk_size: int) -> List[List[Tuple[str, int]]]:
+    """Cut the question sequence (all yes/no, then radio, then checkbox) into chunks of (type, count) parts"""
+    chunks, current, filled = [], [], 0
+    for qtype, count in counts:
+        while count > 0:
+            take = min(count, chunk_size - filled)
+            current.append((qtype, take))
+            filled += take
+            count -= take
+            if filled == chunk_size:
+                chunks.append(current)
+                current, filled = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+def write_bulk_questions(args, counts: List[Tuple[str, int]], cache_dir: Optional[str]):
+    """
+    Generate the questions chunk by chunk (in a process pool if possible) and stream every chunk to the output.
+    Chunk i draws from the i-th child of SeedSequence(seed), so the output does not depend on the number of workers
+    """
+    chunks = plan_chunks(counts, args.chunk_size)
+    seed_sequences = np.random.SeedSequence(args.seed).spawn(len(chunks))
+    tasks = list(zip(chunks, seed_sequences))
+
+    parquet = args.output.endswith(".parquet")
+    if parquet:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = pa.schema([("type", pa.string()), ("question", pa.string()), ("truth", pa.string())])
+        writer = pq.ParquetWriter(args.output, schema)
+        def write(questions):
+            columns = list(zip(*questions)) if questions else [[], [], []]
+            writer.write_table(pa.table({"type": columns[0], "question": columns[1], "truth": columns[2]}, schema=schema))
+    else:
+        f = open(args.output, "w", newline="")
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["type", "question", "truth"])
+        def write(questions):
+            writer.writerows(questions)
+
+    try:
+        # workers memory-map the cached index, without a cache everything runs here
+        if args.workers <= 1 or len(tasks) <= 1 or cache_dir is None:
+            for task in tasks:
+                write(generate_question_chunk(task))
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=init_bulk_worker, initargs=(args.input, cache_dir)) as pool:
+                pending = deque()
+                for task in tasks:
+                    pending.append(pool.submit(generate_question_chunk, task))
+                    if len(pending) >= 2 * args.workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    finally:
+        if parquet:
+            writer.close()
+        else:
+            f.close()
+
 def main():
     parser = argparse.ArgumentParser(description='Generate questions from RDF triples')
     parser.add_argument('-input', required=True, help='Path to the input N-Triples file')
@@ -222,6 +631,12 @@ def main():
     parser.add_argument('-yesno', type=float, default=0.33, help='Proportion of yes/no questions')
     parser.add_argument('-radio', type=float, default=0.33, help='Proportion of radio questions')
     parser.add_argument('-checkbox', type=float, default=0.34, help='Proportion of checkbox questions')
+    parser.add_argument('-workers', type=int, default=os.cpu_count(), help='Number of processes parsing the input file in parallel')
+    parser.add_argument('-cache_dir', default=None, help='Directory of the binary cache of the parsed graph (default <input>.index)')
+    parser.add_argument('-no_cache', action='store_true', help='Always parse the input file, without reading or writing the cache')
+    parser.add_argument('-seed', type=int, default=None, help='Random seed, makes the generated questions reproducible')
+    parser.add_argument('-bulk', action='store_true', help='Vectorized generation in chunks streamed to the output (.csv or .parquet)')
+    parser.add_argument('-chunk_size', type=int, default=100000, help='Number of questions per chunk in bulk mode')
     
     args = parser.parse_args()
     
@@ -231,23 +646,28 @@ def main():
         print("Error: Question proportions must sum to 1.0")
         return
     
-    # Parse the NT file
-    triples = parse_nt_file(args.input)
-    if not triples:
+    random.seed(args.seed)
+
+    # Parse the NT file (or open its cached index)
+    cache_dir = None if args.no_cache else (args.cache_dir or args.input + ".index")
+    index = load_entity_index(args.input, args.workers, cache_dir)
+    if index.num_triples() == 0:
         print("No valid triples found in the input file")
         return
     
-    # Sample the requested number of triples
-    if len(triples) < args.num:
-        print(f"Warning: Only {len(triples)} triples available, using all")
-        sampled_triples = triples
-    else:
-        sampled_triples = random.sample(triples, args.num)
-    
     # Calculate number of each question type
     num_yesno = int(args.num * args.yesno)
     num_radio = int(args.num * args.radio)
     num_checkbox = args.num - num_yesno - num_radio  # Ensure we get exactly N questions
+
+    if args.bulk:
+        write_bulk_questions(args, [("yes/no", num_yesno), ("radio", num_radio), ("checkbox", num_checkbox)], cache_dir)
+        return
+
+    # Sample the requested number of triples
+    if index.num_triples() < args.num:
+        print(f"Warning: Only {index.num_triples()} triples available, using all")
+    sampled_triples = index.sample_triples(args.num)
     
     # Generate questions
     questions = []
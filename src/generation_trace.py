@@ -0,0 +1,131 @@
+import json
+import math
+import time
+from collections import defaultdict
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+# Per-call and per-query generation trace
+class GenerationTrace:
+    """JSONL trace of the model calls of a run (latency, time to first token, tokens, peak memory) and of every answered query"""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open(path, "a" if append else "w")
+        self.start = time.perf_counter()
+        self.queries = {}
+        # question type -> per-query values, for the summary
+        self.latencies = defaultdict(list)
+        self.ttfts = defaultdict(list)
+        self.generated_tokens = defaultdict(int)
+        self.invalid = defaultdict(int)
+        self.truncated = defaultdict(int)
+        self.call_time = 0.0
+        self.calls = 0
+        self.peak_memory_mb = None
+
+    def beginBatch(self, types):
+        """Start accumulating the calls of a batch of queries of the given question types"""
+        self.queries = {index: {"type": qtype, "calls": 0, "latency": 0.0, "ttft": None, "prompt_tokens": 0,
+                                "generated_tokens": 0, "samples": 0, "cached_samples": 0, "truncated": False}
+                        for index, qtype in enumerate(types)}
+
+    def addCall(self, indices, stats, num_return_sequences=1):
+        """Attribute one model call (its per-prompt stats) to the queries of the batch at indices"""
+        if stats is None:
+            return
+        self.calls += 1
+        self.call_time += stats["latency"]
+        if stats["peak_memory_mb"] is not None:
+            self.peak_memory_mb = max(self.peak_memory_mb or 0.0, stats["peak_memory_mb"])
+        types = defaultdict(int)
+        cached = stats.get("cached", [False] * len(indices))
+        for i, index in enumerate(indices):
+            query = self.queries[index]
+            types[query["type"]] += 1
+            # every query of the batch waits for the whole call
+            query["calls"] += 1
+            query["latency"] += stats["latency"]
+            if query["ttft"] is None and stats["ttft"] is not None:
+                query["ttft"] = query["latency"] - stats["latency"] + stats["ttft"]
+            query["prompt_tokens"] += stats["prompt_tokens"][i]
+            query["generated_tokens"] += stats["generated_tokens"][i]
+            query["samples"] += num_return_sequences
+            query["cached_samples"] += num_return_sequences if cached[i] else 0
+            query["truncated"] = query["truncated"] or stats["truncated"][i]
+        self.write({
+            "event": "call",
+            "queries": len(indices),
+            "num_return_sequences": num_return_sequences,
+            "types": dict(types),
+            "latency": stats["latency"],
+            "ttft": stats["ttft"],
+            "prompt_tokens": sum(stats["prompt_tokens"]),
+            "generated_tokens": sum(stats["generated_tokens"]),
+            "truncated": sum(stats["truncated"]),
+            "cached": sum(cached),
+            "peak_memory_mb": stats["peak_memory_mb"],
+        })
+
+    def endBatch(self, query_ids, responses, valid):
+        """Write the per-query records of the batch"""
+        for index, query in self.queries.items():
+            qtype = query["type"]
+            self.latencies[qtype].append(query["latency"])
+            if query["ttft"] is not None:
+                self.ttfts[qtype].append(query["ttft"])
+            self.generated_tokens[qtype] += query["generated_tokens"]
+            self.invalid[qtype] += not valid[index]
+            self.truncated[qtype] += query["truncated"]
+            self.write(dict(event="query", query_id=query_ids[index], response=responses[index], valid=valid[index], **query))
+        self.file.flush()
+        self.queries = {}
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def getSummary(self):
+        """Per question type (and 'all'): queries, p50/p95 latency and time to first token, tokens/s, invalid and truncated rates"""
+        summary = {}
+        for qtype in list(self.latencies) + ["all"]:
+            if qtype == "all":
+                latencies = [value for values in self.latencies.values() for value in values]
+                ttfts = [value for values in self.ttfts.values() for value in values]
+                generated_tokens = sum(self.generated_tokens.values())
+                invalid = sum(self.invalid.values())
+                truncated = sum(self.truncated.values())
+            else:
+                latencies, ttfts = self.latencies[qtype], self.ttfts[qtype]
+                generated_tokens, invalid, truncated = self.generated_tokens[qtype], self.invalid[qtype], self.truncated[qtype]
+            queries = len(latencies)
+            summary[qtype] = {
+                "queries": queries,
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "ttft_p50": percentile(ttfts, 50),
+                "ttft_p95": percentile(ttfts, 95),
+                "generated_tokens": generated_tokens,
+                "invalid_rate": invalid / queries if queries else 0.0,
+                "truncated": truncated,
+            }
+        wall_time = time.perf_counter() - self.start
+        summary["all"].update({
+            "calls": self.calls,
+            "wall_time": wall_time,
+            "queries_per_second": summary["all"]["queries"] / wall_time if wall_time else 0.0,
+            # decoding throughput while the model was busy
+            "tokens_per_second": summary["all"]["generated_tokens"] / self.call_time if self.call_time else 0.0,
+            "peak_memory_mb": self.peak_memory_mb,
+        })
+        return summary
+
+    def close(self):
+        summary = self.getSummary()
+        self.write({"event": "summary", **summary})
+        self.file.close()
+        return summary
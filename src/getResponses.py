@@ -1,16 +1,37 @@
+import time
+STARTUP = time.perf_counter()
 from collections import Counter
 from tqdm import tqdm
-from llm_class import PlainLLM
-import torch
+from response_cache import ResponseCache
+from generation_trace import GenerationTrace
+from answer_grammar import AnswerGrammar, checkboxAnswers
+from query_plan import QueryPlan, UNIQUE_QUERIES_FILE, UNIQUE_RESPONSES_FILE
+from sequential_evaluation import SequentialEvaluation, stratifiedOrder
 import argparse
+import hashlib
+import multiprocessing
+import csv
+import os
 import re
-torch.cuda.empty_cache()
+import sys
+# torch and the model classes are imported by loadLLM, only once a model is needed
 
 
 REPEAT_FACTOR = 3
+# self-consistency: samples drawn per query, and whether to stop once the vote is settled
+NUM_SAMPLES = REPEAT_FACTOR
+ADAPTIVE = False
+# constrained decoding: generation can only produce answers of the question type's grammar
+CONSTRAINED = False
+# scoring mode: a checkbox letter is selected if its renormalized probability reaches this value
+CHECKBOX_THRESHOLD = 0.2
 # regex to remove non-chars in necessary
 regex = re.compile('[^a-zA-Z]')
 llm = None
+# optional GenerationTrace of the current run
+trace = None
+# replaced by torch.cuda.OutOfMemoryError once torch is loaded
+OutOfMemoryError = MemoryError
 
 class bcolors:
     BLUE = '\033[94m'
@@ -20,131 +41,577 @@ class bcolors:
     WARNING = '\033[93m'
     ENDC = '\033[0m'
 
-def getYesNoResponse(query):
-    for i in range(REPEAT_FACTOR):
-        responses = []
-        try:
-            response = llm.generate(query + " Instruction: Respond with only 'yes' or 'no'. Do not include any other text or explanation.")  # for yes/no queries, append an extra instruction
-            response = response.replace("\n", " ").lower()
-            response = regex.sub('', response)
-            responses.append(response)
-        except torch.cuda.OutOfMemoryError:
-            print(bcolors.WARNING + f"CUDA out of memory error encountered, skipping query: '{query}'..." + bcolors.ENDC)
-            response = "no response"
-            responses.append(response)
-    # Count occurrences of each option
-    counts = Counter(responses)
-    most_prominent_response = counts.most_common(1)[0][0]
-    # conformity check
-    if most_prominent_response not in ['yes', 'no']:
-        print(bcolors.WARNING + f"Invalid response: {most_prominent_response}" + bcolors.ENDC)
-        most_prominent_response = "no response"
-    return most_prominent_response
-
-def getRadioResponse(query):
-    for i in range(REPEAT_FACTOR):
-        responses = []
-        try:
-            response = llm.generate(query + " \"Instruction: Respond with only the single letter (a-e) corresponding to the correct option. Do not include any explanation or additional text.\"")
-            response = response.replace("\n", " ").lower()
-            response = response.replace(".", "")
-            response = regex.sub('', response)
-            if response not in ["a","b","c","d","e"]:
-                response = "no response"
-            responses.append(response)
-        except torch.cuda.OutOfMemoryError:
-            print(bcolors.WARNING + f"CUDA out of memory error encountered, skipping query: '{query}'..." + bcolors.ENDC)
-            response = "no response"
-            responses.append(response)
-    # Count occurrences of each option
-    counts = Counter(responses)
-    most_prominent_response = counts.most_common(1)[0][0]
-    # conformity check
-    if most_prominent_response not in ['a', 'b', 'c', 'd', 'e']:
-        print(bcolors.WARNING + f"Invalid response: {most_prominent_response}" + bcolors.ENDC)
-        most_prominent_response = "no response"
-    return most_prominent_response
-
-
-def getCheckboxResponse(query):
-    for i in range(REPEAT_FACTOR):
-        responses = []
+YESNO_INSTRUCTION = " Instruction: Respond with only 'yes' or 'no'. Do not include any other text or explanation."
+RADIO_INSTRUCTION = " \"Instruction: Respond with only the single letter (a-e) corresponding to the correct option. Do not include any explanation or additional text.\""
+CHECKBOX_INSTRUCTION = " \"Instruction: Respond with only the letters (a-e) separated with comma, corresponding to the correct options. Do not include any explanation or additional text.\""
+
+def cleanYesNoResponse(response):
+    response = response.replace("\n", " ").lower()
+    return regex.sub('', response)
+
+def cleanRadioResponse(response):
+    response = response.replace("\n", " ").lower()
+    response = response.replace(".", "")
+    return regex.sub('', response)
+
+def cleanCheckboxResponse(response):
+    response = response.replace("\n", " ").lower()
+    response = response.replace(".", "")
+    return response.replace(" ", "")
+
+def isYesNoResponse(response):
+    return response in ['yes', 'no']
+
+def isRadioResponse(response):
+    return response in ['a', 'b', 'c', 'd', 'e']
+
+def isCheckboxResponse(response):
+    return all(token in ['a', 'b', 'c', 'd', 'e', ''] for token in response.split(','))
+
+def voteResponse(responses, isValid):
+    """Majority vote over the valid samples of a query"""
+    # Count occurrences of each valid option
+    counts = Counter(response for response in responses if isValid(response))
+    if not counts:
+        print(bcolors.WARNING + f"Invalid responses: {responses}" + bcolors.ENDC)
+        return "no response"
+    return counts.most_common(1)[0][0]
+
+def isVoteSettled(responses, isValid, remaining):
+    """True if the leading answer can no longer be overturned by the remaining samples"""
+    counts = Counter(response for response in responses if isValid(response)).most_common(2)
+    if not counts:
+        return remaining == 0
+    runner_up = counts[1][1] if len(counts) > 1 else 0
+    return counts[0][1] > runner_up + remaining
+
+# question type -> (instruction appended to the query, sample cleanup, conformity check)
+QUERY_TYPES = {
+    "yes/no": (YESNO_INSTRUCTION, cleanYesNoResponse, isYesNoResponse),
+    "radio": (RADIO_INSTRUCTION, cleanRadioResponse, isRadioResponse),
+    "checkbox": (CHECKBOX_INSTRUCTION, cleanCheckboxResponse, isCheckboxResponse),
+}
+
+def getInstructions():
+    """question type -> instruction appended to its queries"""
+    return {qtype: instruction for qtype, (instruction, _, _) in QUERY_TYPES.items()}
+
+# question type -> grammar of its answers, in the form the conformity checks accept
+QUERY_GRAMMARS = {
+    "yes/no": AnswerGrammar("yes/no", ["yes", "no"]),
+    "radio": AnswerGrammar("radio", ["a", "b", "c", "d", "e"]),
+    "checkbox": AnswerGrammar("checkbox", checkboxAnswers()),
+}
+
+def scoreSingleOption(options, scores):
+    # argmax over the valid answers
+    return options[scores.index(max(scores))]
+
+def scoreMultipleOptions(options, scores):
+    # every option above the threshold, at least the best one
+    best = scoreSingleOption(options, scores)
+    selected = [option for option, score in zip(options, scores) if score >= CHECKBOX_THRESHOLD]
+    if best not in selected:
+        selected.append(best)
+    # 'e' (none of the above) cannot be combined with other options, keep the stronger side
+    if 'e' in selected and len(selected) > 1:
+        if best == 'e':
+            selected = ['e']
+        else:
+            selected.remove('e')
+    return ",".join(sorted(selected))
+
+# question type -> (valid answer tokens, selection over their scores)
+SCORED_QUERY_TYPES = {
+    "yes/no": (['yes', 'no'], scoreSingleOption),
+    "radio": (['a', 'b', 'c', 'd', 'e'], scoreSingleOption),
+    "checkbox": (['a', 'b', 'c', 'd', 'e'], scoreMultipleOptions),
+}
+
+def getBatchScoredResponses(batch):
+    """Answer a batch of (type, query) pairs from the next-token likelihood of each valid answer, in input order"""
+    responses = ["no response"] * len(batch)
+    prompts = []
+    options_batch = []
+    owners = []
+    for index, (qtype, query) in enumerate(batch):
+        if qtype not in QUERY_TYPES:
+            print(bcolors.WARNING + f"Unknown query type encountered '{qtype}', ignoring..." + bcolors.ENDC)
+            continue
+        instruction, _, _ = QUERY_TYPES[qtype]
+        options, _ = SCORED_QUERY_TYPES[qtype]
+        prompts.append(query + instruction)
+        options_batch.append(options)
+        owners.append(index)
+    if not prompts:
+        return responses
+
+    try:
+        scores_batch = llm.scoreBatch(prompts, options_batch)
+        if trace is not None:
+            trace.addCall(owners, llm.last_call_stats)
+    except OutOfMemoryError:
+        print(bcolors.WARNING + f"CUDA out of memory error encountered, skipping batch of {len(batch)} queries..." + bcolors.ENDC)
+        return responses
+
+    for index, scores in zip(owners, scores_batch):
+        options, selectResponse = SCORED_QUERY_TYPES[batch[index][0]]
+        responses[index] = selectResponse(options, scores)
+    return responses
+
+def getBatchResponses(batch):
+    """Answer a batch of (type, query) pairs by self-consistency voting over NUM_SAMPLES samples, in input order"""
+    responses = ["no response"] * len(batch)
+    samples = {}
+    for index, (qtype, query) in enumerate(batch):
+        if qtype not in QUERY_TYPES:
+            print(bcolors.WARNING + f"Unknown query type encountered '{qtype}', ignoring..." + bcolors.ENDC)
+            continue
+        samples[index] = []
+
+    # adaptive mode starts with the fewest samples that can form a majority and then
+    # draws one more at a time, only for the queries whose vote is still open
+    num_samples = NUM_SAMPLES // 2 + 1 if ADAPTIVE else NUM_SAMPLES
+    drawn = 0
+    pending = list(samples)
+    while pending:
+        prompts = [batch[index][1] + QUERY_TYPES[batch[index][0]][0] for index in pending]
+        grammars = [QUERY_GRAMMARS[batch[index][0]] for index in pending] if CONSTRAINED else None
         try:
-            response = llm.generate(query + " \"Instruction: Respond with only the letters (a-e) separated with comma, corresponding to the correct options. Do not include any explanation or additional text.\"")
-            response = response.replace("\n", " ").lower()
-            response = response.replace(".", "")
-            response = response.replace(" ", "")
-            responses.append(response)
-        except torch.cuda.OutOfMemoryError:
-            print(bcolors.WARNING + f"CUDA out of memory error encountered, skipping query: '{query}'..." + bcolors.ENDC)
-            response = "no response"
-            responses.append(response)
-
-    # Count occurrences of each option
-    counts = Counter(responses)
-    most_prominent_response = counts.most_common(1)[0][0]
-    
-    # conformity check
-    tokens = most_prominent_response.split(',')
-    for token in tokens:
-        if token not in ['a', 'b', 'c', 'd', 'e','']:
-            print(bcolors.WARNING + f"Invalid response: {most_prominent_response}" + bcolors.ENDC)
-            most_prominent_response = "no response"
+            # the samples of every prompt are drawn in one call and come back grouped per prompt; generate expands
+            # the prompts before the prefill, so only the -prefix_cache prefix is computed once for all of them
+            outputs = llm.generateBatch(prompts, num_return_sequences=num_samples, first_sample=drawn, grammars=grammars)
+            if trace is not None:
+                trace.addCall(pending, llm.last_call_stats, num_samples)
+        except OutOfMemoryError:
+            print(bcolors.WARNING + f"CUDA out of memory error encountered, skipping batch of {len(pending)} queries..." + bcolors.ENDC)
+            outputs = ["no response"] * (len(prompts) * num_samples)
+        for i, index in enumerate(pending):
+            _, cleanResponse, _ = QUERY_TYPES[batch[index][0]]
+            samples[index] += [cleanResponse(output) for output in outputs[i * num_samples:(i + 1) * num_samples]]
+        drawn += num_samples
+        remaining = NUM_SAMPLES - drawn
+        if not ADAPTIVE or remaining <= 0:
             break
-    return most_prominent_response
+        pending = [index for index in pending if not isVoteSettled(samples[index], QUERY_TYPES[batch[index][0]][2], remaining)]
+        num_samples = 1
+
+    for index, query_samples in samples.items():
+        _, _, isValid = QUERY_TYPES[batch[index][0]]
+        responses[index] = voteResponse(query_samples, isValid)
+    return responses
+
+def getQueryId(row):
+    """Stable id of a dataset row (type, query, truth)"""
+    return hashlib.sha1("\x1f".join(row).encode("utf-8")).hexdigest()
+
+def readAnsweredQueries(output_path):
+    """Count the ids of the rows already answered in an existing output file"""
+    answered = Counter()
+    if not os.path.exists(output_path):
+        return answered
+    # drop a partially written last row (e.g. killed mid-write)
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+    with open(output_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        for row in reader:
+            if row:
+                answered[getQueryId(row[:-1])] += 1
+    return answered
+
+def readBatches(dataset_path, batch_size, answered, shard=0, num_shards=1):
+    """Stream the dataset rows (of one round-robin shard) that are not answered yet, batch_size rows at a time"""
+    with open(dataset_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        batch = []
+        # shards own every num_shards-th non-blank row, the order mergeShards interleaves them back in
+        for index, row in enumerate(row for row in reader if row):
+            if index % num_shards != shard:
+                continue
+            query_id = getQueryId(row)
+            if answered[query_id] > 0:
+                answered[query_id] -= 1
+                continue
+            batch.append(row)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def readDatasetRows(dataset_path):
+    with open(dataset_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        return [row for row in reader if row]
+
+def readSequentialBatches(rows, batch_size, answered, seed=None):
+    """The rows that are not answered yet, in a stratified random order (by type and relation), batch_size rows at a time"""
+    batch = []
+    for row in stratifiedOrder(rows, seed):
+        query_id = getQueryId(row)
+        if answered[query_id] > 0:
+            answered[query_id] -= 1
+            continue
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def startSequentialEvaluation(args, rows, output_path, append):
+    """Online metrics of the run, including the rows already in the output file when resuming"""
+    sequential = SequentialEvaluation(sorted({row[0] for row in rows}), args.tolerance, args.metric, args.confidence,
+                                      args.min_queries, seed=args.seed)
+    if append:
+        with open(output_path, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            answered_rows = [row for row in reader if row]
+        sequential.update([row[:-1] for row in answered_rows], [row[-1] for row in answered_rows])
+    return sequential
+
+def printSequentialSummary(sequential, total):
+    used = sum(len(answered["truth"]) for answered in sequential.answered.values())
+    status = "settled" if sequential.isDone() else "not settled, the dataset ran out"
+    print(bcolors.GREEN + f"Sequential evaluation {status}: {used} of {total} questions used ({used / total:.0%})" + bcolors.ENDC)
+    for qtype in sequential.types:
+        interval = sequential.getInterval(qtype)
+        print(bcolors.GREEN + f"{qtype}: {sequential.metric} {interval[sequential.metric]:.3f} ± {interval['half_width']:.3f} "
+              f"[{interval['low']:.3f}, {interval['high']:.3f}] over {interval['rows']} questions" + bcolors.ENDC)
+
+def getServerSocket(args):
+    """Socket of the running model server that answers this run, None if the model is loaded here"""
+    if args.api_base or args.no_server:
+        return None
+    from model_server import getSocketPath, isServing
+    socket_path = args.server_socket or getSocketPath(args.model)
+    return socket_path if isServing(socket_path) else None
+
+def loadLLM(args):
+    """Set the run configuration and load the model, returns the response cache (if any)"""
+    global llm, CHECKBOX_THRESHOLD, NUM_SAMPLES, ADAPTIVE, CONSTRAINED, OutOfMemoryError
+    CHECKBOX_THRESHOLD = args.checkbox_threshold
+    NUM_SAMPLES = args.num_samples
+    ADAPTIVE = args.adaptive
+    CONSTRAINED = args.constrained
+
+    # a running model server already has the model loaded
+    socket_path = getServerSocket(args)
+    if socket_path is not None:
+        from model_server import ServerLLM
+        llm = ServerLLM(socket_path, args.model, args.quantize_bits, args.device)
+        if args.max_new_tokens is not None:
+            llm.decoding_params = dict(llm.decoding_params, max_new_tokens=args.max_new_tokens)
+        if args.cache_path:
+            print(bcolors.WARNING + "-cache_path is ignored with a model server, start the server with -cache_path instead" + bcolors.ENDC)
+        if args.prompt_store:
+            print(bcolors.WARNING + "-prompt_store is ignored with a model server" + bcolors.ENDC)
+        if args.draft_model != llm.draft_model:
+            print(bcolors.WARNING + f"-draft_model is ignored with a model server, the server runs with draft model {llm.draft_model}" + bcolors.ENDC)
+        if args.device not in ("auto", llm.device):
+            print(bcolors.WARNING + f"-device {args.device} is ignored with a model server, the server runs on {llm.device}" + bcolors.ENDC)
+        if args.cpu_threads:
+            print(bcolors.WARNING + "-cpu_threads is ignored with a model server, start the server with -cpu_threads instead" + bcolors.ENDC)
+        if args.prefix_cache != llm.prefix_cache:
+            print(bcolors.WARNING + f"-prefix_cache is ignored with a model server, the server runs {'with' if llm.prefix_cache else 'without'} it" + bcolors.ENDC)
+        print(bcolors.GREEN + f"Using the model server at {socket_path} (queue depth {llm.getStatus()['queue_depth']})" + bcolors.ENDC)
+        return None
+
+    # heavy imports, the HTTP backend needs neither torch nor transformers
+    start = time.perf_counter()
+    if args.api_base:
+        from openai_llm import OpenAILLM
+    else:
+        import torch
+        from llm_class import PlainLLM
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        OutOfMemoryError = torch.cuda.OutOfMemoryError
+    imported = time.perf_counter()
+
+    # init llm
+    response_cache = None
+    if args.cache_path:
+        response_cache = ResponseCache(args.cache_path, args.cache_max_entries, args.cache_max_age_days)
+    if args.api_base:
+        llm = OpenAILLM(args.model, args.api_base, api_key=args.api_key or os.environ.get("OPENAI_API_KEY"),
+                        max_in_flight=args.max_in_flight, request_timeout=args.request_timeout,
+                        max_retries=args.max_retries, response_cache=response_cache)
+        print(bcolors.GREEN + f"Using OpenAI-compatible endpoint {args.api_base}" + bcolors.ENDC)
+    else:
+        llm = PlainLLM(args.model, quantize_bits=args.quantize_bits, prefix_cache=args.prefix_cache, response_cache=response_cache,
+                       draft_modelid=args.draft_model, device=args.device, cpu_threads=args.cpu_threads)
+        print(bcolors.GREEN + f"Using default LLM on {llm.device} ({llm.model.dtype}, quantization {llm.quantization})" + bcolors.ENDC)
+        if args.prompt_store:
+            # generation reads the templated, tokenized prompts of the dataset from the store
+            from prompt_store import openPromptStore
+            llm.prompt_store = openPromptStore(llm, args.query_dataset_path, args.prompt_store, getInstructions())
+    if args.max_new_tokens is not None:
+        llm.decoding_params = dict(llm.decoding_params, max_new_tokens=args.max_new_tokens)
+
+    if args.profile_startup:
+        print(bcolors.CYAN + f"startup: {(start - STARTUP) * 1000:.1f} ms, backend import: {(imported - start) * 1000:.1f} ms, "
+              f"model load: {(time.perf_counter() - imported) * 1000:.1f} ms" + bcolors.ENDC)
+    return response_cache
+
+def printStats(args, response_cache):
+    if response_cache is not None:
+        stats = response_cache.getStats()
+        print(bcolors.GREEN + f"Response cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate']:.2f}, {stats['entries']} entries)" + bcolors.ENDC)
+        response_cache.close()
+    if args.prefix_cache and hasattr(llm, "getPrefixCacheStats"):
+        stats = llm.getPrefixCacheStats()
+        print(bcolors.GREEN + f"Prefix cache: {stats['hits']} hits, {stats['misses']} misses ({stats['prefix_tokens']} cached prefix tokens)" + bcolors.ENDC)
+    if getattr(llm, "draft_model", None) is not None:
+        stats = llm.getAssistedStats()
+        print(bcolors.GREEN + f"Assisted generation: {stats['accepted_tokens']} of {stats['draft_forwards']} draft tokens accepted "
+              f"(acceptance rate {stats['acceptance_rate']:.2f}), {stats['tokens_per_forward']:.2f} tokens per forward pass of the model" + bcolors.ENDC)
+    # remote backends hold a connection
+    if hasattr(llm, "close"):
+        llm.close()
+
+def getTracePath(output_path):
+    """<output>.trace.jsonl beside the responses CSV"""
+    root, extension = os.path.splitext(output_path)
+    return (root if extension == ".csv" else output_path) + ".trace.jsonl"
+
+def printTraceSummary(summary, trace_path):
+    print(bcolors.GREEN + f"Generation trace written to {trace_path}" + bcolors.ENDC)
+    for qtype, stats in summary.items():
+        if not stats["queries"]:
+            continue
+        ttft = f", TTFT p50 {stats['ttft_p50']:.3f} s" if stats["ttft_p50"] is not None else ""
+        print(bcolors.GREEN + f"{qtype}: {stats['queries']} queries, latency p50 {stats['latency_p50']:.3f} s / p95 {stats['latency_p95']:.3f} s{ttft}, "
+              f"{stats['generated_tokens']} generated tokens, invalid rate {stats['invalid_rate']:.2f}, {stats['truncated']} truncated" + bcolors.ENDC)
+    stats = summary["all"]
+    peak_memory = f", peak memory {stats['peak_memory_mb']:.0f} MB" if stats["peak_memory_mb"] is not None else ""
+    print(bcolors.GREEN + f"Throughput: {stats['queries_per_second']:.2f} queries/s, {stats['tokens_per_second']:.1f} tokens/s "
+          f"over {stats['calls']} model calls{peak_memory}" + bcolors.ENDC)
+    if stats["truncated"]:
+        print(bcolors.WARNING + f"{stats['truncated']} queries hit max_new_tokens, see the trace for runaway generations" + bcolors.ENDC)
+
+def answerQueries(args, output_path, shard=0, num_shards=1):
+    """Answer the queries of one shard of the dataset into output_path (all of it by default)"""
+    global trace
+    answered = Counter()
+    if args.resume:
+        answered = readAnsweredQueries(output_path)
+        print(bcolors.GREEN + f"Resuming, {sum(answered.values())} queries already answered" + bcolors.ENDC)
+    append = args.resume and os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+    if args.trace:
+        trace = GenerationTrace(getTracePath(output_path), append=append)
+        llm.instrument = True
+
+    sequential = None
+    if args.sequential:
+        dataset_rows = readDatasetRows(args.query_dataset_path)
+        sequential = startSequentialEvaluation(args, dataset_rows, output_path, append)
+
+    description = "Evaluating queries..." if num_shards == 1 else f"Shard {shard}"
+    with open(output_path, "a" if append else "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        if not append:
+            writer.writerow(["type", "query", "truth", "response"])
+        if sequential is not None:
+            batches = readSequentialBatches(dataset_rows, args.batch_size, answered, args.seed)
+        else:
+            batches = readBatches(args.query_dataset_path, args.batch_size, answered, shard, num_shards)
+        for rows in tqdm(batches, desc=description, position=shard):
+            batch = []
+            for row in rows:
+                # get query type
+                qtype = row[0]
+                query = row[1]
+                print(bcolors.BLUE + f"Query Type: {qtype}, Query: " + query + bcolors.ENDC)
+                batch.append((qtype, query))
+            if trace is not None:
+                trace.beginBatch([qtype for qtype, _ in batch])
+
+            # get responses based on type, in input order
+            if args.mode == "score":
+                responses = getBatchScoredResponses(batch)
+            else:
+                responses = getBatchResponses(batch)
+
+            for row, response in zip(rows, responses):
+                print(bcolors.RED + "response: " + response + bcolors.ENDC)
+                writer.writerow(row + [response])
+            # persist every finished batch, a crash only loses the batch in flight
+            f.flush()
+            os.fsync(f.fileno())
+            if trace is not None:
+                valid = [qtype in QUERY_TYPES and QUERY_TYPES[qtype][2](response) for (qtype, _), response in zip(batch, responses)]
+                trace.endBatch([getQueryId(row) for row in rows], responses, valid)
+            if sequential is not None:
+                sequential.update(rows, responses)
+                if sequential.isDone():
+                    break
+
+    if sequential is not None:
+        printSequentialSummary(sequential, len(dataset_rows))
+    if trace is not None:
+        printTraceSummary(trace.close(), getTracePath(output_path))
+        trace = None
+
+def getShardPath(output_path, shard):
+    return f"{output_path}.shard{shard}"
+
+def runShard(args, shard):
+    """Worker process: pin the device/threads, load a model replica and answer one shard"""
+    if args.devices:
+        devices = args.devices.split(",")
+        os.environ["CUDA_VISIBLE_DEVICES"] = devices[shard % len(devices)]
+    if args.threads_per_worker:
+        import torch
+        torch.set_num_threads(args.threads_per_worker)
+    response_cache = loadLLM(args)
+    answerQueries(args, getShardPath(args.query_result_path, shard), shard, args.workers)
+    printStats(args, response_cache)
+
+def mergeShards(output_path, num_shards):
+    """Interleave the round-robin shard outputs back into the original row order"""
+    shard_files = [open(getShardPath(output_path, shard), "r", newline="") for shard in range(num_shards)]
+    readers = [csv.reader(f) for f in shard_files]
+    for reader in readers:
+        next(reader, None)  # header
+    with open(output_path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["type", "query", "truth", "response"])
+        active = readers
+        while active:
+            remaining = []
+            for reader in active:
+                row = next(reader, None)
+                if row is not None:
+                    writer.writerow(row)
+                    remaining.append(reader)
+            active = remaining
+    for shard, f in enumerate(shard_files):
+        f.close()
+        os.remove(getShardPath(output_path, shard))
+
+def printPlanStats(args, plan):
+    duplicates = plan.getDuplicateQueries()
+    # a query costs NUM_SAMPLES samples (at most, with -adaptive) in sample mode and one forward pass in score mode
+    calls_per_query = 1 if args.mode == "score" else args.num_samples
+    print(bcolors.GREEN + f"{plan.getTotalQueries()} queries in {len(plan.dataset_paths)} datasets, {len(plan.unique_rows)} unique: "
+          f"{duplicates} duplicate queries ({duplicates * calls_per_query} model samples) saved" + bcolors.ENDC)
+
+def runQueries(args):
+    """Answer args.query_dataset_path into args.query_result_path, returns False if it could not finish"""
+    if args.workers > 1:
+        # workers resume from their .shard<k> files only, and the merge replaces the output file
+        if args.resume and sum(readAnsweredQueries(args.query_result_path).values()):
+            print(bcolors.RED + f"{args.query_result_path} already has answered rows, which -workers would not resume "
+                  "but overwrite: resume it with -workers 1" + bcolors.ENDC)
+            return False
+        if args.prompt_store and not args.api_base and getServerSocket(args) is None:
+            # built once here, the workers only memory-map it
+            from llm_class import PlainLLM
+            from prompt_store import openPromptStore
+            openPromptStore(PlainLLM(args.model, tokenizer_only=True), args.query_dataset_path, args.prompt_store, getInstructions())
+        # one process and model replica per shard, merged back in input order
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=runShard, args=(args, shard)) for shard in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [shard for shard, worker in enumerate(workers) if worker.exitcode != 0]
+        if failed:
+            print(bcolors.WARNING + f"Shards {failed} failed, rerun with -resume to finish them" + bcolors.ENDC)
+            return False
+        mergeShards(args.query_result_path, args.workers)
+        return True
+
+    response_cache = loadLLM(args)
+    answerQueries(args, args.query_result_path)
+    printStats(args, response_cache)
+    return True
 
 def main():
-    global llm
     # Define argument parser
     parser = argparse.ArgumentParser(description="Run an LLM with optional RAG functionality.")
 
     # Add arguments
-    parser.add_argument("-query_dataset_path", type=str, help="Path of the query dataset to use")
-    parser.add_argument("-query_result_path", type=str, help="Path of the output result")
+    parser.add_argument("-query_dataset_path", type=str, nargs="+", help="Path of the query dataset to use (several with -dedup)")
+    parser.add_argument("-query_result_path", type=str, help="Path of the output result (a directory with -dedup)")
+    parser.add_argument("-dedup", action="store_true", help="Answer every unique (type, query) of the datasets once and write each dataset's responses to -query_result_path/<dataset file name>")
     parser.add_argument("-model", type=str, default="meta-llama/Meta-Llama-3.1-8B-Instruct", help="LLM model to load")
+    parser.add_argument("-mode", type=str, default="sample", choices=["sample", "score"],
+                        help="'sample' generates and votes over free-form answers, 'score' picks answers from the option likelihoods of one forward pass")
+    parser.add_argument("-checkbox_threshold", type=float, default=CHECKBOX_THRESHOLD, help="Minimum option probability for a checkbox letter to be selected in 'score' mode")
+    parser.add_argument("-num_samples", type=int, default=REPEAT_FACTOR, help="Number of samples drawn per query for the majority vote in 'sample' mode")
+    parser.add_argument("-adaptive", action="store_true", help="Stop sampling a query once its leading answer can no longer be overturned")
+    parser.add_argument("-constrained", action="store_true", help="In 'sample' mode, constrain generation to the answer grammar of each question type (yes|no, a-e, sorted comma-separated letters) and stop once the answer is complete")
+    parser.add_argument("-prefix_cache", action="store_true", help="Prefill the shared system role prefix once and reuse its KV cache for every query")
+    parser.add_argument("-device", type=str, default="auto", choices=["auto", "cuda", "cpu"], help="'cuda' places the model with device_map='auto' in bfloat16, 'cpu' runs the CPU backend; 'auto' picks CUDA when available")
+    parser.add_argument("-quantize_bits", type=int, default=None, choices=[4, 8], help="Quantize the model: bitsandbytes 4 or 8-bit on CUDA, dynamic int8 linear layers on the CPU")
+    parser.add_argument("-cpu_threads", type=int, default=None, help="Number of intra-op threads of the CPU backend")
+    parser.add_argument("-draft_model", type=str, default=None, help="Small model sharing -model's tokenizer that drafts tokens for assisted generation (outputs are unchanged under greedy decoding)")
+    parser.add_argument("-prompt_store", type=str, default=None, help="Directory of pre-tokenized prompt stores (see prompt_store.py); the dataset's store for the model's tokenizer and chat template is built on first use")
+    parser.add_argument("-max_new_tokens", type=int, default=None, help="Maximum number of generated tokens per sample (default 4096)")
+    parser.add_argument("-batch_size", type=int, default=1, help="Number of queries to generate responses for in one batched call")
+    parser.add_argument("-cache_path", type=str, default=None, help="SQLite file of the persistent response cache (disabled if not set)")
+    parser.add_argument("-cache_max_entries", type=int, default=None, help="Keep at most this many (most recently used) cached responses")
+    parser.add_argument("-cache_max_age_days", type=float, default=None, help="Drop cached responses older than this many days")
+    parser.add_argument("-resume", action="store_true", help="Keep the rows already answered in the output file and only process the rest")
+    parser.add_argument("-api_base", type=str, default=None, help="Base URL of an OpenAI-compatible server (e.g. http://localhost:8000/v1) to query instead of loading the model locally")
+    parser.add_argument("-api_key", type=str, default=None, help="API key of the server (defaults to $OPENAI_API_KEY)")
+    parser.add_argument("-max_in_flight", type=int, default=32, help="Maximum number of concurrent requests to the server")
+    parser.add_argument("-request_timeout", type=float, default=600, help="Timeout of a single request in seconds")
+    parser.add_argument("-max_retries", type=int, default=3, help="Retries (with exponential backoff) of a failed request")
+    parser.add_argument("-profile_startup", action="store_true", help="Print the import and model load times")
+    parser.add_argument("-trace", action="store_true", help="Record per-call and per-query latency, time to first token, token counts and peak memory to <output>.trace.jsonl and print a summary")
+    parser.add_argument("-server_socket", type=str, default=None, help="Unix socket of a running model_server.py (default: the socket of -model's server, used if it is running)")
+    parser.add_argument("-no_server", action="store_true", help="Always load the model in this process, even if a model server is running")
+    parser.add_argument("-sequential", action="store_true", help="Answer the queries in a stratified random order (by type and relation) and stop once the confidence interval of -metric is within -tolerance for every question type")
+    parser.add_argument("-metric", type=str, default="f1", choices=["precision", "recall", "f1"], help="Target metric of -sequential")
+    parser.add_argument("-tolerance", type=float, default=0.02, help="Half-width of the confidence interval at which -sequential stops")
+    parser.add_argument("-confidence", type=float, default=0.95, help="Confidence level of the -sequential bootstrap intervals")
+    parser.add_argument("-min_queries", type=int, default=30, help="Questions of each type answered before -sequential may stop")
+    parser.add_argument("-seed", type=int, default=0, help="Seed of the -sequential order (keep it to -resume the same order)")
+    parser.add_argument("-workers", type=int, default=1, help="Number of worker processes, each with its own model replica and a shard of the dataset")
+    parser.add_argument("-devices", type=str, default=None, help="Comma-separated CUDA devices assigned round-robin to the workers (e.g. '0,1,2,3')")
+    parser.add_argument("-threads_per_worker", type=int, default=None, help="Number of intra-op CPU threads per worker")
 
     # Parse arguments
     args = parser.parse_args()
 
-    # default model is meta-llama/Meta-Llama-3.1-8B-Instruct
-    llm_modelid = args.model
+    print(bcolors.GREEN + f"Running model {args.model}" + bcolors.ENDC)
+    if args.sequential and args.workers > 1:
+        parser.error("-sequential answers the queries in one order and stops early, it cannot be split across -workers")
+    if args.sequential and args.dedup:
+        parser.error("-sequential stops before every unique query is answered, its responses cannot be fanned out with -dedup")
 
-    # init llm
-    llm = PlainLLM(llm_modelid)
-    print(bcolors.GREEN + "Using default LLM" + bcolors.ENDC)
-
-    # parse queries
-    entries = None
-    with open(args.query_dataset_path, "r") as f:
-        document = f.read()
-        entries = document.strip().split("\n")[1:]
-
-    print(bcolors.GREEN + f"Running model {llm_modelid}" + bcolors.ENDC)
-
-    output_path = args.query_result_path
-    with open(output_path, "w") as f:
-        f.write("type,query,truth,response\n")
-        for index,entry in tqdm(enumerate(entries), desc="Evaluating queries..."):
-            tokens = entry.split(',') 
-            # get query type
-            qtype = tokens[0]
-            query = tokens[1]
-            print(bcolors.BLUE + f"Query Type: {qtype}, Query: " + query + bcolors.ENDC)
-
-            # get response based on type
-            if qtype == "yes/no":
-                response = getYesNoResponse(query)
-            elif qtype == "radio":
-                response = getRadioResponse(query)
-            elif qtype == "checkbox":
-                response = getCheckboxResponse(query)
-            else:
-                print(bcolors.WARNING + f"Unknown query type encountered '{qtype}', ignoring..." + bcolors.ENDC)
-                response = "no response"
+    if not args.dedup:
+        if len(args.query_dataset_path) > 1:
+            parser.error("several -query_dataset_path files need -dedup")
+        args.query_dataset_path = args.query_dataset_path[0]
+        if not runQueries(args):
+            sys.exit(1)
+        return
 
-            print(bcolors.RED + "response: " + response + bcolors.ENDC)
-            entry += "," + response
-            f.write(entry + "\n")
+    # planning stage: the unique queries of all datasets form one dataset, answered once
+    output_dir = args.query_result_path
+    os.makedirs(output_dir, exist_ok=True)
+    plan = QueryPlan(args.query_dataset_path)
+    args.query_dataset_path = os.path.join(output_dir, UNIQUE_QUERIES_FILE)
+    args.query_result_path = os.path.join(output_dir, UNIQUE_RESPONSES_FILE)
+    plan.writeUniqueQueries(args.query_dataset_path)
+    printPlanStats(args, plan)
+    if not runQueries(args):
+        sys.exit(1)
+    for dataset_path, output_path in plan.fanOut(args.query_result_path, output_dir):
+        print(bcolors.GREEN + f"{dataset_path} -> {output_path}" + bcolors.ENDC)
 
 
 if __name__=="__main__":
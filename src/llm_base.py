@@ -0,0 +1,103 @@
+import time
+from response_cache import ResponseCache
+
+# Model-agnostic part of the LLM classes, importable without torch/transformers
+
+def makeCallStats(start, first_token_time, prompt_tokens, generated_tokens, truncated, peak_memory_mb):
+    """Stats of one model call, token counts and truncation flags are per prompt (summed over its samples)"""
+    end = time.perf_counter()
+    return {
+        "latency": end - start,
+        "ttft": None if first_token_time is None else first_token_time - start,
+        "prompt_tokens": prompt_tokens,
+        "generated_tokens": generated_tokens,
+        "truncated": truncated,
+        "peak_memory_mb": peak_memory_mb,
+    }
+
+class BaseLLM:
+    """System role, decoding params and the response cache in front of batched generation; backends implement
+    templateBatch, generateFromPrompts and scoreAndDecodeBatch"""
+    llm_modelid = ""
+    system_role = []
+    quantization = "none"
+    # sampling parameters of every generate call (also part of the response cache key)
+    decoding_params = {"max_new_tokens": 4096, "do_sample": True, "temperature": 0.7, "top_p": 0.9}
+    # optional persistent ResponseCache in front of batched generation
+    response_cache = None
+    # per-call instrumentation: when set, every model call leaves its stats in last_call_stats
+    instrument = False
+    last_call_stats = None
+
+    def getSystemRole(self):
+            return self.system_role
+
+    def generateSystemRole(self):
+        self.system_role = [{"role": "system", "content": "You are a bot that answers spatial reasoning questions."}]
+
+    def getDecodingParams(self, grammars=None):
+        """Decoding params of a call, a constrained answer needs at most one token per character plus a terminator"""
+        if not grammars:
+            return self.decoding_params
+        max_new_tokens = max(grammar.max_length for grammar in grammars) + 1
+        return dict(self.decoding_params, max_new_tokens=min(self.decoding_params["max_new_tokens"], max_new_tokens))
+
+    def getResponseCacheKey(self, prompt_hash, sample_index, grammar=None):
+        # constrained answers are cached apart from free-form ones, and apart from other answer sets of the same name
+        decoding_params = self.decoding_params if grammar is None else dict(self.decoding_params, grammar=[grammar.name, grammar.answers])
+        return self.response_cache.makeKey(self.llm_modelid, self.quantization, prompt_hash, decoding_params, sample_index)
+
+    def generateCached(self, prompt_hashes, generate, num_return_sequences=1, first_sample=0, grammars=None):
+        """
+        Samples of a batch of prompts (given by the hashes of the templated prompts), read from the response cache
+        when possible; generate(indices, grammars) produces the samples of the prompts at indices
+        """
+        if self.response_cache is None:
+            return generate(list(range(len(prompt_hashes))), grammars)
+
+        # samples first_sample..first_sample+num_return_sequences-1 of every prompt
+        keys = [
+            [self.getResponseCacheKey(prompt_hash, first_sample + i, grammars[index] if grammars else None) for i in range(num_return_sequences)]
+            for index, prompt_hash in enumerate(prompt_hashes)
+        ]
+        start = time.perf_counter()
+        cached = self.response_cache.get(key for prompt_keys in keys for key in prompt_keys)
+        # only the prompts with a missing sample go to the model
+        missing = [index for index, prompt_keys in enumerate(keys) if not all(key in cached for key in prompt_keys)]
+        if missing:
+            outputs = generate(missing, [grammars[index] for index in missing] if grammars else None)
+            generated = {}
+            for i, index in enumerate(missing):
+                for sample, key in enumerate(keys[index]):
+                    generated[key] = outputs[i * num_return_sequences + sample]
+            self.response_cache.put(generated)
+            cached.update(generated)
+        if self.instrument:
+            # per-prompt stats of the whole batch, cached prompts cost no tokens
+            call_stats = self.last_call_stats if missing else makeCallStats(start, None, [], [], [], None)
+            stats = dict(call_stats, prompt_tokens=[0] * len(keys), generated_tokens=[0] * len(keys),
+                         truncated=[False] * len(keys), cached=[True] * len(keys))
+            for i, index in enumerate(missing):
+                for name in ("prompt_tokens", "generated_tokens", "truncated"):
+                    stats[name][index] = call_stats[name][i]
+                stats["cached"][index] = False
+            self.last_call_stats = stats
+        return [cached[key] for prompt_keys in keys for key in prompt_keys]
+
+    def generateAndDecodeBatch(self, messages_batch, num_return_sequences=1, first_sample=0, grammars=None):
+        prompts = self.templateBatch(messages_batch)
+        return self.generateCached(
+            [ResponseCache.hashPrompt(prompt) for prompt in prompts],
+            lambda indices, grammars: self.generateFromPrompts([prompts[index] for index in indices], num_return_sequences, grammars),
+            num_return_sequences, first_sample, grammars
+        )
+
+    def generateBatch(self, messages_batch, num_return_sequences=1, first_sample=0, grammars=None):
+        # add the system role to every conversation, outputs keep the input order
+        messages_batch = [self.getSystemRole() + messages for messages in messages_batch]
+        return self.generateAndDecodeBatch(messages_batch, num_return_sequences, first_sample, grammars)
+
+    def scoreBatch(self, messages_batch, options_batch):
+        # add the system role to every conversation, scores keep the input order
+        messages_batch = [self.getSystemRole() + messages for messages in messages_batch]
+        return self.scoreAndDecodeBatch(messages_batch, options_batch)
@@ -1,5 +1,10 @@
+import copy
+import hashlib
+import json
+import time
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, DynamicCache, LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from llm_base import BaseLLM, makeCallStats
 
 class bcolors:
     BLUE = '\033[94m'
@@ -11,31 +16,130 @@ class bcolors:
     WARNING = '\033[93m'
     ENDC = '\033[0m'
 
+class FirstTokenTimer(StoppingCriteria):
+    """Records when the first new token is out, never stops generation"""
+    def __init__(self):
+        self.first_token_time = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class GrammarLogitsProcessor(LogitsProcessor):
+    """
+    Constrains every row to its answer grammar: only the tokens that keep the generated text inside the grammar
+    are allowed, and once the answer is complete only the terminators
+    """
+    def __init__(self, llm, grammars, prompt_length):
+        self.llm = llm
+        self.grammars = grammars
+        self.prompt_length = prompt_length
+        # per row, the generated tokens seen so far and the grammar state after each of them (None once a
+        # terminator is out); assisted generation may roll back rejected draft tokens
+        self.tokens = [[] for _ in grammars]
+        self.states = [[0] for _ in grammars]
+
+    def getState(self, row, tokens):
+        common = 0
+        known = self.tokens[row]
+        while common < min(len(known), len(tokens)) and known[common] == tokens[common]:
+            common += 1
+        states = self.states[row][:common + 1]
+        for token in tokens[common:]:
+            state = states[-1]
+            if state is not None:
+                transitions, _ = self.llm.getGrammarTransitions(self.grammars[row], state)
+                state = transitions.get(token)
+            states.append(state)
+        self.tokens[row], self.states[row] = tokens, states
+        return states[-1]
+
+    def __call__(self, input_ids, scores):
+        mask = torch.full_like(scores, float("-inf"))
+        for row, tokens in enumerate(input_ids[:, self.prompt_length:].tolist()):
+            state = self.getState(row, tokens)
+            if state is None:
+                # finished rows only receive padding
+                mask[row] = 0
+            else:
+                _, allowed = self.llm.getGrammarTransitions(self.grammars[row], state)
+                mask[row, allowed] = 0
+        return scores + mask
+
+def resetPeakMemory():
+    for device in range(torch.cuda.device_count()):
+        torch.cuda.reset_peak_memory_stats(device)
+
+def getPeakMemory():
+    """Peak allocated GPU memory since the last reset (all devices), or the peak RSS of the process on CPU, in MB"""
+    if torch.cuda.is_available():
+        return sum(torch.cuda.max_memory_allocated(device) for device in range(torch.cuda.device_count())) / 2**20
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+def getCpuDtype():
+    """bfloat16 if the CPU computes it natively (AVX512-BF16/AMX on x86, BF16 on ARM), float32 otherwise"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = set(f.read().split())
+    except OSError:
+        return torch.float32
+    return torch.bfloat16 if flags & {"avx512_bf16", "amx_bf16", "bf16"} else torch.float32
+
 # Base LLM class
-class LLM:
-    llm_modelid = ""
+class LLM(BaseLLM):
     # default bnb quantization config - none
     bnb_config = BitsAndBytesConfig()
     model = None
     terminators = None
     tokenizer = None
-    system_role = []
+    option_token_ids = None
+    # shared-prefix KV cache (system role + start of the user turn)
+    prefix_ids = None
+    prefix_cache = None
+    prefix_cache_hits = 0
+    prefix_cache_misses = 0
+    # constrained decoding: decoded text of every token, (grammar, state) -> (token -> next state, allowed token ids)
+    token_strings = None
+    grammar_transitions = None
+    # optional PromptStore of pre-tokenized prompts, used when it holds every prompt of a batch
+    prompt_store = None
+    # "cuda": device_map="auto" placement in bfloat16 with bitsandbytes quantization; "cpu": CPU dtype, optional
+    # dynamic int8 quantization and cpu_threads intra-op threads
+    device = "cuda"
+    cpu_threads = None
+    # assisted generation: a small model sharing the tokenizer drafts tokens that the model verifies
+    draft_modelid = None
+    draft_model = None
+    # forward passes of both models (counted by hooks) and the totals of the assisted generate calls
+    forward_counts = None
+    assisted_stats = None
 
-    def getSystemRole(self):
-            return self.system_role
-    
-    def generateSystemRole(self):
-        self.system_role = [{"role": "system", "content": "You are a bot that answers spatial reasoning questions."}]
+    def loadTokenizer(self):
+        self.tokenizer = AutoTokenizer.from_pretrained(self.llm_modelid)
+        # left padding so that batched prompts end right where generation starts
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
 
     def loadModel(self):        
         # Load LLM
-        self.tokenizer = AutoTokenizer.from_pretrained(self.llm_modelid)
-        self.model = AutoModelForCausalLM.from_pretrained(
-            self.llm_modelid,
-            torch_dtype=torch.bfloat16,
-            device_map="auto",
-            quantization_config=self.bnb_config
-            )
+        self.loadTokenizer()
+        if self.device == "cpu":
+            self.loadCpuModel()
+        else:
+            self.model = AutoModelForCausalLM.from_pretrained(
+                self.llm_modelid,
+                torch_dtype=torch.bfloat16,
+                device_map="auto",
+                quantization_config=self.bnb_config
+                )
+        if self.draft_modelid is not None:
+            self.loadDraftModel()
+        # answer option -> candidate first token ids (scoring mode)
+        self.option_token_ids = {}
+        self.grammar_transitions = {}
         # terminators
         self.terminators = []
         if self.tokenizer.eos_token_id is not None:
@@ -47,28 +151,328 @@ class LLM:
         except Exception:
             pass
 
-    def generateAndDecode(self, messages):
+    def loadCpuModel(self):
+        # bitsandbytes targets CUDA: int8 quantization on the CPU replaces the linear layers by dynamically quantized
+        # ones (int8 weights, activations quantized on the fly), which need float32 activations
+        if self.cpu_threads:
+            torch.set_num_threads(self.cpu_threads)
+        dtype = torch.float32 if self.quantization == "int8-dynamic" else getCpuDtype()
+        self.model = AutoModelForCausalLM.from_pretrained(self.llm_modelid, torch_dtype=dtype)
+        if self.quantization == "int8-dynamic":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model.eval()
+
+    def warmUp(self):
+        # the first calls pay for kernel selection and allocations, keep them out of the first batch
+        inputs = self.tokenizer(["Question: warm up"], add_special_tokens=False, return_tensors="pt").to(self.model.device)
+        with torch.no_grad():
+            self.model.generate(**inputs, max_new_tokens=2, do_sample=False, pad_token_id=self.tokenizer.pad_token_id)
+
+    def loadDraftModel(self):
+        # its proposals are verified token by token, so both models must tokenize the same way
+        draft_tokenizer = AutoTokenizer.from_pretrained(self.draft_modelid)
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            raise ValueError(f"The draft model {self.draft_modelid} does not share the tokenizer of {self.llm_modelid}")
+        self.draft_model = AutoModelForCausalLM.from_pretrained(self.draft_modelid, torch_dtype=self.model.dtype,
+                                                                device_map="auto" if self.device == "cuda" else None)
+        self.forward_counts = {"model": 0, "draft": 0}
+        self.assisted_stats = {"generated_tokens": 0, "model_forwards": 0, "draft_forwards": 0}
+        self.model.register_forward_hook(self.getForwardCounter("model"))
+        self.draft_model.register_forward_hook(self.getForwardCounter("draft"))
+
+    def getForwardCounter(self, name):
+        def hook(module, inputs, outputs):
+            self.forward_counts[name] += 1
+        return hook
+
+    def updateAssistedStats(self, forward_counts, generated_tokens):
+        """Add an assisted generate call to assisted_stats: its generated tokens and the forward passes since forward_counts"""
+        self.assisted_stats["generated_tokens"] += generated_tokens
+        self.assisted_stats["model_forwards"] += self.forward_counts["model"] - forward_counts["model"]
+        self.assisted_stats["draft_forwards"] += self.forward_counts["draft"] - forward_counts["draft"]
+
+    def getAssistedStats(self):
+        """
+        Draft tokens proposed and accepted in assisted generation. Every verifying forward pass of the model keeps the
+        accepted draft tokens plus one token of its own, every draft forward pass proposes one token
+        """
+        stats = dict(self.assisted_stats)
+        stats["accepted_tokens"] = max(0, stats["generated_tokens"] - stats["model_forwards"])
+        stats["acceptance_rate"] = stats["accepted_tokens"] / stats["draft_forwards"] if stats["draft_forwards"] else 0.0
+        stats["tokens_per_forward"] = stats["generated_tokens"] / stats["model_forwards"] if stats["model_forwards"] else 0.0
+        return stats
+
+    def buildPrefixCache(self, content_prefix=""):
+        # the templated text every conversation starts with, up to the first user-specific character
+        sentinel = "\u2063QUERY\u2063"
+        messages = self.getSystemRole() + [{"role": "user", "content": content_prefix + sentinel}]
+        templated = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        prefix_text = templated[:templated.index(sentinel)]
+        prefix_ids = self.tokenizer(prefix_text, add_special_tokens=False)["input_ids"]
+        # drop the last token, it may merge with the first query token
+        self.prefix_ids = prefix_ids[:-1]
+        if not self.prefix_ids:
+            self.prefix_cache = None
+            return
+        with torch.no_grad():
+            self.prefix_cache = self.model(
+                torch.tensor([self.prefix_ids], device=self.model.device),
+                past_key_values=DynamicCache(),
+                use_cache=True
+            ).past_key_values
+        self.prefix_cache_hits = 0
+        self.prefix_cache_misses = 0
+
+    def getPrefixCacheStats(self):
+        return {"hits": self.prefix_cache_hits, "misses": self.prefix_cache_misses, "prefix_tokens": len(self.prefix_ids or [])}
+
+    def templateBatch(self, messages_batch):
+        return [
+            self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+            for messages in messages_batch
+        ]
+
+    def getTemplateFingerprint(self):
+        """sha256 of everything that turns a user prompt into token ids: tokenizer, chat template, system role and user turn"""
+        digest = hashlib.sha256()
+        try:
+            digest.update(self.tokenizer.backend_tokenizer.to_str().encode("utf-8"))
+        except AttributeError:
+            # slow tokenizers have no serialized form, their vocabulary stands in for it
+            digest.update(json.dumps(self.tokenizer.get_vocab(), sort_keys=True).encode("utf-8"))
+        digest.update(json.dumps([self.tokenizer.chat_template, self.getSystemRole(), self.getMessages("{prompt}")]).encode("utf-8"))
+        return digest.hexdigest()
+
+    def tokenizeBatch(self, prompts, num_return_sequences=1):
+        # tokenize the templated prompts together (left-padded)
+        return self.prepareInputs(self.tokenizer(prompts, add_special_tokens=False)["input_ids"], num_return_sequences)
+
+    def prepareInputs(self, ids_batch, num_return_sequences=1):
+        # left-pad the token ids of the prompts into one batch
+        if self.prefix_cache is not None:
+            prefix_length = len(self.prefix_ids)
+            suffixes = []
+            for ids in ids_batch:
+                if ids[:prefix_length] != self.prefix_ids:
+                    break
+                suffixes.append(ids[prefix_length:])
+            if len(suffixes) == len(ids_batch):
+                self.prefix_cache_hits += len(ids_batch)
+                # [shared prefix | left-padded suffix]: the padding in the middle is masked out and
+                # positions follow the attention mask, so only the suffixes need a prefill
+                padded = self.tokenizer.pad({"input_ids": suffixes}, padding=True, return_tensors="pt")
+                prefix = torch.tensor([self.prefix_ids] * len(ids_batch))
+                inputs = {
+                    "input_ids": torch.cat([prefix, padded["input_ids"]], dim=-1).to(self.model.device),
+                    "attention_mask": torch.cat([torch.ones_like(prefix), padded["attention_mask"]], dim=-1).to(self.model.device),
+                }
+                past_key_values = copy.deepcopy(self.prefix_cache)
+                past_key_values.batch_repeat_interleave(len(ids_batch) * num_return_sequences)
+                return inputs, past_key_values
+            self.prefix_cache_misses += len(ids_batch)
+        inputs = self.tokenizer.pad({"input_ids": ids_batch}, padding=True, return_tensors="pt").to(self.model.device)
+        return inputs, None
+
+    def countGeneratedTokens(self, responses, num_return_sequences=1):
+        """Generated tokens (up to the first terminator) and truncation flags of each prompt"""
+        stop_ids = torch.tensor(self.terminators + [self.tokenizer.pad_token_id], device=responses.device)
+        stops = torch.isin(responses, stop_ids)
+        ended = stops.any(dim=-1)
+        lengths = torch.where(ended, stops.int().argmax(dim=-1) + 1, responses.shape[-1])
+        generated_tokens = lengths.view(-1, num_return_sequences).sum(dim=-1).tolist()
+        # a sample without a terminator ran into max_new_tokens
+        truncated = (~ended).view(-1, num_return_sequences).any(dim=-1).tolist()
+        return generated_tokens, truncated
+
+    def getGrammarTransitions(self, grammar, state):
+        """Tokens allowed in a grammar state and the state each one leads to (None for the terminators)"""
+        key = (grammar, state)
+        if key not in self.grammar_transitions:
+            if self.token_strings is None:
+                self.token_strings = self.tokenizer.batch_decode([[token_id] for token_id in range(len(self.tokenizer))])
+            special_ids = set(self.tokenizer.all_special_ids)
+            transitions = {}
+            for token_id, text in enumerate(self.token_strings):
+                if token_id in special_ids:
+                    continue
+                # the answer may start after whitespace
+                if state == 0:
+                    text = text.lstrip()
+                next_state = grammar.step(state, text) if text else None
+                if next_state is not None:
+                    transitions[token_id] = next_state
+            if grammar.isAccepting(state):
+                for token_id in self.terminators:
+                    transitions[token_id] = None
+            self.grammar_transitions[key] = (transitions, torch.tensor(sorted(transitions), device=self.model.device))
+        return self.grammar_transitions[key]
+
+    def getLogitsProcessor(self, grammars, num_return_sequences, prompt_length):
+        if not grammars:
+            return None
+        # the samples of each prompt are consecutive rows
+        row_grammars = [grammar for grammar in grammars for _ in range(num_return_sequences)]
+        return LogitsProcessorList([GrammarLogitsProcessor(self, row_grammars, prompt_length)])
+
+    def generateAndDecode(self, messages, grammar=None):
         input_ids = self.tokenizer.apply_chat_template(
             messages,
             add_generation_prompt=True,
             return_tensors="pt"
         ).to(self.model.device)
+        if self.instrument:
+            resetPeakMemory()
+        timer = FirstTokenTimer()
+        start = time.perf_counter()
+        forward_counts = dict(self.forward_counts) if self.draft_model is not None else None
+        grammars = [grammar] if grammar is not None else None
         outputs = self.model.generate(
             input_ids,
-            max_new_tokens=4096,
-            do_sample=True,
+            assistant_model=self.draft_model,
             eos_token_id=self.terminators,
-            temperature=0.7,
-            top_p=0.9,
+            logits_processor=self.getLogitsProcessor(grammars, 1, input_ids.shape[-1]),
+            stopping_criteria=StoppingCriteriaList([timer]) if self.instrument else None,
+            **self.getDecodingParams(grammars),
         )
         response = outputs[0][input_ids.shape[-1]:]
+        if self.instrument or self.draft_model is not None:
+            generated_tokens, truncated = self.countGeneratedTokens(response[None])
+        if self.draft_model is not None:
+            self.updateAssistedStats(forward_counts, generated_tokens[0])
+        if self.instrument:
+            self.last_call_stats = makeCallStats(start, timer.first_token_time, [input_ids.shape[-1]], generated_tokens,
+                                                 truncated, getPeakMemory())
         decoded_response = self.tokenizer.decode(response, skip_special_tokens=True)
         return decoded_response
 
-    def generate(self, messages):
+    def generateFromPrompts(self, prompts, num_return_sequences=1, grammars=None):
+        ids_batch = self.tokenizer(prompts, add_special_tokens=False)["input_ids"]
+        return self.generateFromIds(ids_batch, num_return_sequences, grammars)
+
+    def generateFromIds(self, ids_batch, num_return_sequences=1, grammars=None):
+        if self.draft_model is not None:
+            return self.generateAssisted(ids_batch, num_return_sequences, grammars)
+        inputs, past_key_values = self.prepareInputs(ids_batch, num_return_sequences)
+        if self.instrument:
+            resetPeakMemory()
+        timer = FirstTokenTimer()
+        start = time.perf_counter()
+        outputs = self.model.generate(
+            **inputs,
+            past_key_values=past_key_values,
+            eos_token_id=self.terminators,
+            pad_token_id=self.tokenizer.pad_token_id,
+            num_return_sequences=num_return_sequences,
+            logits_processor=self.getLogitsProcessor(grammars, num_return_sequences, inputs["input_ids"].shape[-1]),
+            stopping_criteria=StoppingCriteriaList([timer]) if self.instrument else None,
+            **self.getDecodingParams(grammars),
+        )
+        # all prompts share the same padded length, responses start right after it
+        # (with several return sequences, the samples of each prompt are consecutive)
+        responses = outputs[:, inputs["input_ids"].shape[-1]:]
+        if self.instrument:
+            generated_tokens, truncated = self.countGeneratedTokens(responses, num_return_sequences)
+            self.last_call_stats = makeCallStats(start, timer.first_token_time, inputs["attention_mask"].sum(dim=-1).tolist(),
+                                                 generated_tokens, truncated, getPeakMemory())
+        return self.tokenizer.batch_decode(responses, skip_special_tokens=True)
+
+    def generateAssisted(self, ids_batch, num_return_sequences=1, grammars=None):
+        # transformers runs assisted generation one sequence at a time, without the prefix cache
+        if self.instrument:
+            resetPeakMemory()
+        start = time.perf_counter()
+        first_token_time = None
+        forward_counts = dict(self.forward_counts)
+        responses, generated_tokens, truncated = [], [], []
+        for index, ids in enumerate(ids_batch):
+            input_ids = torch.tensor([ids], device=self.model.device)
+            prompt_grammars = [grammars[index]] if grammars else None
+            prompt_generated_tokens, prompt_truncated = 0, False
+            for _ in range(num_return_sequences):
+                timer = FirstTokenTimer()
+                outputs = self.model.generate(
+                    input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    assistant_model=self.draft_model,
+                    eos_token_id=self.terminators,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    logits_processor=self.getLogitsProcessor(prompt_grammars, 1, input_ids.shape[-1]),
+                    stopping_criteria=StoppingCriteriaList([timer]),
+                    **self.getDecodingParams(prompt_grammars),
+                )
+                first_token_time = first_token_time or timer.first_token_time
+                response = outputs[0, input_ids.shape[-1]:]
+                [sample_tokens], [sample_truncated] = self.countGeneratedTokens(response[None])
+                prompt_generated_tokens += sample_tokens
+                prompt_truncated = prompt_truncated or sample_truncated
+                responses.append(self.tokenizer.decode(response, skip_special_tokens=True))
+            generated_tokens.append(prompt_generated_tokens)
+            truncated.append(prompt_truncated)
+        self.updateAssistedStats(forward_counts, sum(generated_tokens))
+        if self.instrument:
+            self.last_call_stats = makeCallStats(start, first_token_time, [len(ids) for ids in ids_batch], generated_tokens,
+                                                 truncated, getPeakMemory())
+        return responses
+
+    def generateStoredBatch(self, rows, num_return_sequences=1, first_sample=0, grammars=None):
+        # prompts of the prompt store (system role included), already templated and tokenized
+        return self.generateCached(
+            [self.prompt_store.getPromptHash(row) for row in rows],
+            lambda indices, grammars: self.generateFromIds([self.prompt_store.getIds(rows[index]) for index in indices], num_return_sequences, grammars),
+            num_return_sequences, first_sample, grammars
+        )
+
+    def getOptionTokenIds(self, option):
+        # first token of every surface form the model may start the option with
+        if option in self.option_token_ids:
+            return self.option_token_ids[option]
+        token_ids = set()
+        for variant in [option, option.capitalize(), " " + option, " " + option.capitalize()]:
+            ids = self.tokenizer.encode(variant, add_special_tokens=False)
+            if ids:
+                token_ids.add(ids[0])
+        self.option_token_ids[option] = sorted(token_ids)
+        return self.option_token_ids[option]
+
+    def scoreAndDecodeBatch(self, messages_batch, options_batch):
+        prompts = self.templateBatch(messages_batch)
+        return self.scoreFromIds(self.tokenizer(prompts, add_special_tokens=False)["input_ids"], options_batch)
+
+    def scoreFromIds(self, ids_batch, options_batch):
+        # one forward pass per batch, no decoding: read the next-token distribution at the end of each prompt
+        inputs, past_key_values = self.prepareInputs(ids_batch)
+        if self.instrument:
+            resetPeakMemory()
+        start = time.perf_counter()
+        with torch.no_grad():
+            if past_key_values is None:
+                logits = self.model(**inputs).logits[:, -1, :]
+            else:
+                # feed only the uncached tokens, positions follow the attention mask
+                prefix_length = len(self.prefix_ids)
+                position_ids = (inputs["attention_mask"].cumsum(-1) - 1).clamp(min=0)
+                logits = self.model(
+                    input_ids=inputs["input_ids"][:, prefix_length:],
+                    attention_mask=inputs["attention_mask"],
+                    position_ids=position_ids[:, prefix_length:],
+                    past_key_values=past_key_values
+                ).logits[:, -1, :]
+        probs = torch.softmax(logits.float(), dim=-1)
+        if self.instrument:
+            self.last_call_stats = makeCallStats(start, None, inputs["attention_mask"].sum(dim=-1).tolist(),
+                                                 [0] * len(ids_batch), [False] * len(ids_batch), getPeakMemory())
+        # per prompt, the probability of each option renormalized over its own option set
+        scores = []
+        for row, options in zip(probs, options_batch):
+            option_probs = torch.stack([row[self.getOptionTokenIds(option)].sum() for option in options])
+            option_probs = option_probs / option_probs.sum().clamp_min(1e-12)
+            scores.append(option_probs.tolist())
+        return scores
+
+    def generate(self, messages, grammar=None):
         # add the system role
         messages = self.getSystemRole() + messages
-        return self.generateAndDecode(messages)
+        return self.generateAndDecode(messages, grammar)
 
     # def __init__(self, llm_modelid):
     #     self.llm_modelid = llm_modelid
@@ -77,15 +481,52 @@ class LLM:
 
 # Plain LLM
 class PlainLLM(LLM):
-    def generate(self, prompt, k=0):
-        messages = [{"role": "user", "content": "Question: " + prompt+"\n"}]
-        return super().generate(messages)
+    def getMessages(self, prompt):
+        return [{"role": "user", "content": "Question: " + prompt+"\n"}]
+
+    def getStoredRows(self, prompts):
+        # rows of the prompts in the prompt store, None unless it holds all of them
+        if self.prompt_store is None:
+            return None
+        rows = self.prompt_store.lookup(prompts)
+        return None if -1 in rows else rows
+
+    def generate(self, prompt, k=0, grammar=None):
+        messages = self.getMessages(prompt)
+        return super().generate(messages, grammar)
+
+    def generateBatch(self, prompts, num_return_sequences=1, first_sample=0, grammars=None):
+        rows = self.getStoredRows(prompts)
+        if rows is not None:
+            return self.generateStoredBatch(rows, num_return_sequences, first_sample, grammars)
+        messages_batch = [self.getMessages(prompt) for prompt in prompts]
+        return super().generateBatch(messages_batch, num_return_sequences, first_sample, grammars)
+
+    def scoreBatch(self, prompts, options_batch):
+        rows = self.getStoredRows(prompts)
+        if rows is not None:
+            return self.scoreFromIds([self.prompt_store.getIds(row) for row in rows], options_batch)
+        messages_batch = [self.getMessages(prompt) for prompt in prompts]
+        return super().scoreBatch(messages_batch, options_batch)
     
-    def __init__(self, llm_modelid, quantize_bits=None):
+    def __init__(self, llm_modelid, quantize_bits=None, prefix_cache=False, response_cache=None, tokenizer_only=False, draft_modelid=None,
+                 device="auto", cpu_threads=None):
         # model id
         self.llm_modelid = llm_modelid
+        self.draft_modelid = draft_modelid
+        # "auto": CUDA when available, the CPU backend otherwise
+        self.device = device if device != "auto" else ("cuda" if torch.cuda.is_available() else "cpu")
+        self.cpu_threads = cpu_threads
+        self.quantization = f"{quantize_bits}bit" if quantize_bits in (4, 8) else "none"
+        self.response_cache = response_cache
         # set quantization
-        if quantize_bits == 4:
+        if self.device == "cpu" and quantize_bits == 4:
+            raise ValueError("4-bit quantization needs CUDA, use -quantize_bits 8 (dynamic int8) on the CPU")
+        if self.device == "cpu":
+            self.bnb_config = None
+            if quantize_bits == 8:
+                self.quantization = "int8-dynamic"
+        elif quantize_bits == 4:
             self.bnb_config = BitsAndBytesConfig(load_in_4bit=True)
         elif quantize_bits == 8:
             self.bnb_config = BitsAndBytesConfig(
@@ -96,7 +537,16 @@ class PlainLLM(LLM):
             )   
         else:
             self.bnb_config = BitsAndBytesConfig()
-        # load model (TE and LLM)
-        self.loadModel()
         # set system role
         self.generateSystemRole()
+        # the tokenizer alone is enough to pre-tokenize prompts
+        if tokenizer_only:
+            self.loadTokenizer()
+            return
+        # load model (TE and LLM)
+        self.loadModel()
+        if self.device == "cpu":
+            self.warmUp()
+        # prefill the constant system role + "Question: " prefix once
+        if prefix_cache:
+            self.buildPrefixCache("Question: ")
@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from answer_grammar import AnswerGrammar
+from response_cache import ResponseCache
+
+class bcolors:
+    BLUE = '\033[94m'
+    CYAN = '\033[96m'
+    RED = '\033[91m'
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    ENDC = '\033[0m'
+
+# Protocol: one JSON request per line, answered by one JSON line
+#   {"method": "generateBatch", "prompts": [...], "num_return_sequences": n, "first_sample": i,
+#    "grammars": [[name, answers], ...] | null, "decoding_params": {...}, "instrument": bool}
+#   {"method": "scoreBatch", "prompts": [...], "options_batch": [...], "instrument": bool}
+#   {"method": "status"} / {"method": "prefixCacheStats"} / {"method": "assistedStats"}
+# -> {"result": ..., "call_stats": ..., "queue_depth": n} or {"error": message, "error_type": name}
+
+def getQuantizationName(quantize_bits, device="auto"):
+    """Quantization PlainLLM loads a model with on a device: bitsandbytes on CUDA, dynamic int8 on the CPU"""
+    if quantize_bits not in (4, 8):
+        return "none"
+    if quantize_bits == 8 and device == "auto":
+        # only 8 bits depends on where "auto" puts the model
+        import torch
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return "int8-dynamic" if quantize_bits == 8 and device == "cpu" else f"{quantize_bits}bit"
+
+def getSocketPath(model):
+    """Default socket of the server of a model, so that clients find it from the model id alone"""
+    digest = hashlib.sha1(model.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"llm-server-{digest}.sock")
+
+# Server side
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves one loaded model to any number of clients. Every client connection has its own thread, requests
+    from all of them go through one queue to the single thread that runs the model
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, llm):
+        self.llm = llm
+        self.requests = queue.Queue()
+        self.started = time.time()
+        self.served = 0
+        self.grammars = {}
+        # the model default, for clients that do not send their own
+        self.default_decoding_params = dict(llm.decoding_params)
+        super().__init__(socket_path, ModelRequestHandler)
+        os.chmod(socket_path, 0o600)
+        threading.Thread(target=self.runModel, daemon=True).start()
+
+    def getQueueDepth(self):
+        return self.requests.qsize()
+
+    def submit(self, request):
+        """Queue a model request and wait for its reply"""
+        done = threading.Event()
+        item = {"request": request, "done": done}
+        self.requests.put(item)
+        done.wait()
+        return item["reply"]
+
+    def runModel(self):
+        while True:
+            item = self.requests.get()
+            try:
+                item["reply"] = self.execute(item["request"])
+            except Exception as e:
+                item["reply"] = {"error": str(e), "error_type": type(e).__name__}
+            self.served += 1
+            item["done"].set()
+            print(bcolors.CYAN + f"{item['request']['method']}: {len(item['request'].get('prompts', []))} prompts, "
+                  f"{self.served} requests served, queue depth {self.getQueueDepth()}" + bcolors.ENDC)
+
+    def getGrammar(self, name, answers):
+        # clients may send different answers under the same name
+        key = (name, tuple(answers))
+        if key not in self.grammars:
+            self.grammars[key] = AnswerGrammar(name, answers)
+        return self.grammars[key]
+
+    def execute(self, request):
+        llm = self.llm
+        llm.instrument = request.get("instrument", False)
+        llm.last_call_stats = None
+        if request["method"] == "generateBatch":
+            llm.decoding_params = request.get("decoding_params") or self.default_decoding_params
+            grammars = [self.getGrammar(name, answers) for name, answers in request["grammars"]] if request.get("grammars") else None
+            result = llm.generateBatch(request["prompts"], request["num_return_sequences"], request["first_sample"], grammars)
+        elif request["method"] == "scoreBatch":
+            result = llm.scoreBatch(request["prompts"], request["options_batch"])
+        elif request["method"] == "prefixCacheStats":
+            result = llm.getPrefixCacheStats()
+        elif request["method"] == "assistedStats":
+            result = llm.getAssistedStats()
+        else:
+            raise ValueError(f"Unknown method {request['method']}")
+        return {"result": result, "call_stats": llm.last_call_stats, "queue_depth": self.getQueueDepth()}
+
+    def getStatus(self):
+        return {
+            "model": self.llm.llm_modelid,
+            "quantization": self.llm.quantization,
+            "draft_model": self.llm.draft_modelid,
+            "device": self.llm.device,
+            "prefix_cache": self.llm.prefix_cache is not None,
+            "decoding_params": self.default_decoding_params,
+            "queue_depth": self.getQueueDepth(),
+            "served": self.served,
+            "uptime": time.time() - self.started,
+        }
+
+class ModelRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            request = json.loads(line)
+            if request["method"] == "status":
+                # answered right away, without queueing behind model calls
+                reply = {"result": self.server.getStatus()}
+            else:
+                reply = self.server.submit(request)
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+def isServing(socket_path):
+    """True if a server is listening on socket_path"""
+    if not os.path.exists(socket_path):
+        return False
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+# Client side
+class ServerLLM:
+    """Client of a model server, with the generate/score interface of PlainLLM"""
+
+    def __init__(self, socket_path, llm_modelid=None, quantize_bits=None, device="auto"):
+        self.socket_path = socket_path
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.stream = self.socket.makefile("rwb")
+        status = self.getStatus()
+        if llm_modelid is not None and status["model"] != llm_modelid:
+            self.close()
+            raise ValueError(f"The server at {socket_path} serves {status['model']}, not {llm_modelid}")
+        quantization = getQuantizationName(quantize_bits, device)
+        if status["quantization"] != quantization:
+            self.close()
+            raise ValueError(f"The server at {socket_path} serves {status['model']} with quantization {status['quantization']}, "
+                             f"not {quantization}; start a server with the same -quantize_bits and -device or run with -no_server")
+        self.llm_modelid = status["model"]
+        self.quantization = status["quantization"]
+        self.device = status["device"]
+        self.prefix_cache = status["prefix_cache"]
+        # id of the server's draft model, if it runs assisted generation
+        self.draft_model = status["draft_model"]
+        # sent with every request, so that every client decodes with its own parameters
+        self.decoding_params = status["decoding_params"]
+        self.instrument = False
+        self.last_call_stats = None
+        self.queue_depth = 0
+
+    def request(self, request):
+        self.stream.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError(f"The server at {self.socket_path} closed the connection")
+        reply = json.loads(line)
+        if "error" in reply:
+            # keep out of memory errors recognizable (skipped batch) for the caller
+            if reply["error_type"] in ("OutOfMemoryError", "MemoryError"):
+                raise MemoryError(reply["error"])
+            raise RuntimeError(f"Server error ({reply['error_type']}): {reply['error']}")
+        self.last_call_stats = reply.get("call_stats")
+        self.queue_depth = reply.get("queue_depth", 0)
+        return reply["result"]
+
+    def getStatus(self):
+        return self.request({"method": "status"})
+
+    def generate(self, prompt, k=0, grammar=None):
+        return self.generateBatch([prompt], grammars=[grammar] if grammar is not None else None)[0]
+
+    def generateBatch(self, prompts, num_return_sequences=1, first_sample=0, grammars=None):
+        return self.request({
+            "method": "generateBatch",
+            "prompts": prompts,
+            "num_return_sequences": num_return_sequences,
+            "first_sample": first_sample,
+            "grammars": [[grammar.name, grammar.answers] for grammar in grammars] if grammars else None,
+            "decoding_params": self.decoding_params,
+            "instrument": self.instrument,
+        })
+
+    def scoreBatch(self, prompts, options_batch):
+        return self.request({"method": "scoreBatch", "prompts": prompts, "options_batch": options_batch, "instrument": self.instrument})
+
+    def getPrefixCacheStats(self):
+        return self.request({"method": "prefixCacheStats"})
+
+    def getAssistedStats(self):
+        return self.request({"method": "assistedStats"})
+
+    def close(self):
+        self.stream.close()
+        self.socket.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a model once and serve generate/score requests over a Unix socket.")
+    parser.add_argument("-model", type=str, default="meta-llama/Meta-Llama-3.1-8B-Instruct", help="LLM model to load")
+    parser.add_argument("-socket", type=str, default=None, help="Socket path (default: a path derived from the model id, where getResponses.py looks for it)")
+    parser.add_argument("-device", type=str, default="auto", choices=["auto", "cuda", "cpu"], help="'cuda' places the model with device_map='auto' in bfloat16, 'cpu' runs the CPU backend; 'auto' picks CUDA when available")
+    parser.add_argument("-quantize_bits", type=int, default=None, choices=[4, 8], help="Quantize the model: bitsandbytes 4 or 8-bit on CUDA, dynamic int8 linear layers on the CPU")
+    parser.add_argument("-cpu_threads", type=int, default=None, help="Number of intra-op threads of the CPU backend")
+    parser.add_argument("-draft_model", type=str, default=None, help="Small model sharing -model's tokenizer that drafts tokens for assisted generation")
+    parser.add_argument("-prefix_cache", action="store_true", help="Prefill the shared system role prefix once and reuse its KV cache for every query")
+    parser.add_argument("-cache_path", type=str, default=None, help="SQLite file of a persistent response cache shared by all clients")
+    parser.add_argument("-cache_max_entries", type=int, default=None, help="Keep at most this many (most recently used) cached responses")
+    parser.add_argument("-cache_max_age_days", type=float, default=None, help="Drop cached responses older than this many days")
+    args = parser.parse_args()
+
+    socket_path = args.socket or getSocketPath(args.model)
+    if isServing(socket_path):
+        print(bcolors.RED + f"A server is already listening on {socket_path}" + bcolors.ENDC)
+        return
+    if os.path.exists(socket_path):
+        # left over by a server that did not shut down cleanly
+        os.remove(socket_path)
+
+    import torch
+    from llm_class import PlainLLM
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    start = time.perf_counter()
+    response_cache = ResponseCache(args.cache_path, args.cache_max_entries, args.cache_max_age_days) if args.cache_path else None
+    llm = PlainLLM(args.model, quantize_bits=args.quantize_bits, prefix_cache=args.prefix_cache, response_cache=response_cache,
+                   draft_modelid=args.draft_model, device=args.device, cpu_threads=args.cpu_threads)
+    print(bcolors.GREEN + f"Loaded {args.model} in {time.perf_counter() - start:.1f} s" + bcolors.ENDC)
+
+    server = ModelServer(socket_path, llm)
+    print(bcolors.GREEN + f"Serving on {socket_path}" + bcolors.ENDC)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        if response_cache is not None:
+            response_cache.close()
+
+if __name__ == "__main__":
+    main()
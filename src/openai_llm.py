@@ -0,0 +1,134 @@
+import asyncio
+import json
+import math
+import random
+import time
+import aiohttp
+from llm_base import BaseLLM, makeCallStats
+
+# LLM served behind an OpenAI-compatible chat completions endpoint, no local model (nor torch) needed
+class OpenAILLM(BaseLLM):
+    # retried with exponential backoff, other statuses fail right away
+    RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+    def getMessages(self, prompt):
+        return [{"role": "user", "content": "Question: " + prompt+"\n"}]
+
+    def generateBatch(self, prompts, num_return_sequences=1, first_sample=0, grammars=None):
+        messages_batch = [self.getMessages(prompt) for prompt in prompts]
+        return super().generateBatch(messages_batch, num_return_sequences, first_sample, grammars)
+
+    def scoreBatch(self, prompts, options_batch):
+        messages_batch = [self.getMessages(prompt) for prompt in prompts]
+        return super().scoreBatch(messages_batch, options_batch)
+
+    # conversations are sent as-is, their JSON form is the "templated" prompt (and response cache key)
+    def templateBatch(self, messages_batch):
+        return [json.dumps(messages) for messages in messages_batch]
+
+    def generateFromPrompts(self, prompts, num_return_sequences=1, grammars=None):
+        decoding_params = self.getDecodingParams(grammars)
+        payloads = [{
+            "messages": json.loads(prompt),
+            "n": num_return_sequences,
+            "max_tokens": decoding_params["max_new_tokens"],
+            "temperature": decoding_params["temperature"],
+            "top_p": decoding_params["top_p"],
+        } for prompt in prompts]
+        if grammars:
+            # the answer grammars are finite, servers with guided decoding (vLLM) take them as a choice list
+            for payload, grammar in zip(payloads, grammars):
+                payload["guided_choice"] = grammar.answers
+        start = time.perf_counter()
+        completions = self.loop.run_until_complete(self.requestAll(payloads))
+        if self.instrument:
+            # token counts as reported by the server, no time to first token without streaming
+            self.last_call_stats = makeCallStats(
+                start, None,
+                [completion.get("usage", {}).get("prompt_tokens", 0) for completion in completions],
+                [completion.get("usage", {}).get("completion_tokens", 0) for completion in completions],
+                [any(choice.get("finish_reason") == "length" for choice in completion["choices"]) for completion in completions],
+                None
+            )
+        # samples of each prompt are consecutive, like the local backend
+        return [choice["message"]["content"] or "" for completion in completions for choice in completion["choices"]]
+
+    def scoreAndDecodeBatch(self, messages_batch, options_batch):
+        # one generated token, scored from its top log-probabilities
+        payloads = [{
+            "messages": messages,
+            "max_tokens": 1,
+            "temperature": 0,
+            "logprobs": True,
+            "top_logprobs": 20,
+        } for messages in messages_batch]
+        start = time.perf_counter()
+        completions = self.loop.run_until_complete(self.requestAll(payloads))
+        if self.instrument:
+            self.last_call_stats = makeCallStats(
+                start, None,
+                [completion.get("usage", {}).get("prompt_tokens", 0) for completion in completions],
+                [0] * len(completions), [False] * len(completions), None
+            )
+        scores = []
+        for completion, options in zip(completions, options_batch):
+            top_logprobs = completion["choices"][0]["logprobs"]["content"][0]["top_logprobs"]
+            option_probs = [0.0] * len(options)
+            for candidate in top_logprobs:
+                token = candidate["token"].strip().lower()
+                if token in options:
+                    option_probs[options.index(token)] += math.exp(candidate["logprob"])
+            total = sum(option_probs)
+            scores.append([prob / total if total > 0 else 1 / len(options) for prob in option_probs])
+        return scores
+
+    async def requestAll(self, payloads):
+        # at most max_in_flight requests are sent at once, results keep the input order
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else None,
+            )
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        return await asyncio.gather(*[self.request(payload) for payload in payloads])
+
+    async def request(self, payload):
+        payload = dict(payload, model=self.llm_modelid)
+        for attempt in range(self.max_retries + 1):
+            # the timeout starts once the request has a slot, not while it waits for one
+            async with self.in_flight:
+                try:
+                    async with self.session.post(self.base_url + "/chat/completions", json=payload,
+                                                 timeout=aiohttp.ClientTimeout(total=self.request_timeout)) as response:
+                        if response.status not in self.RETRY_STATUSES:
+                            response.raise_for_status()
+                            return await response.json()
+                        error = f"HTTP {response.status}"
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    error = repr(e)
+            if attempt == self.max_retries:
+                raise RuntimeError(f"Request failed after {self.max_retries + 1} attempts: {error}")
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt * (1 + random.random()))
+
+    def close(self):
+        if self.session is not None:
+            self.loop.run_until_complete(self.session.close())
+            self.session = None
+        self.loop.close()
+
+    def __init__(self, llm_modelid, base_url, api_key=None, max_in_flight=32, request_timeout=600, max_retries=3, retry_backoff=1.0, response_cache=None):
+        # model id as known by the server
+        self.llm_modelid = llm_modelid
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.response_cache = response_cache
+        # one event loop and pooled session for the lifetime of the backend
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self.in_flight = None
+        # set system role
+        self.generateSystemRole()
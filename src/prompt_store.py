@@ -0,0 +1,141 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+from array import array
+import numpy as np
+
+class bcolors:
+    GREEN = '\033[92m'
+    WARNING = '\033[93m'
+    ENDC = '\033[0m'
+
+def promptKey(prompt):
+    """64-bit key of a user prompt (query + instruction)"""
+    return int.from_bytes(hashlib.sha1(prompt.encode("utf-8")).digest()[:8], "little")
+
+def datasetFingerprint(dataset_path):
+    digest = hashlib.sha256()
+    with open(dataset_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def getStoreDir(store_dir, template_fingerprint, dataset_path):
+    """<store_dir>/<tokenizer and template>/<dataset>: models with the same tokenizer and chat template share it"""
+    return os.path.join(store_dir, template_fingerprint[:16], datasetFingerprint(dataset_path)[:16])
+
+# Pre-tokenized prompts of a dataset
+class PromptStore:
+    """
+    Templated and tokenized prompts of a dataset, as a flat token id array with per-prompt offsets. Prompts are
+    looked up by the key of their user prompt; the sha256 of each templated prompt is kept for response cache keys
+    """
+    ARRAYS = ["ids", "offsets", "keys", "rows", "prompt_hashes"]
+
+    def __init__(self, arrays):
+        self.ids = arrays["ids"]
+        self.offsets = arrays["offsets"]
+        # sorted prompt keys and the row of each
+        self.keys = arrays["keys"]
+        self.rows = arrays["rows"]
+        self.prompt_hashes = arrays["prompt_hashes"]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lookup(self, prompts):
+        """Row of every prompt, -1 for the prompts that are not in the store"""
+        if len(self.keys) == 0:
+            return [-1] * len(prompts)
+        keys = np.array([promptKey(prompt) for prompt in prompts], dtype=np.uint64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, self.rows[positions], -1).tolist()
+
+    def getIds(self, row):
+        return self.ids[self.offsets[row]:self.offsets[row + 1]].tolist()
+
+    def getPromptHash(self, row):
+        return bytes(self.prompt_hashes[row]).hex()
+
+    @staticmethod
+    def build(llm, prompts, store_dir, meta, batch_size=1024):
+        """Template and tokenize the unique prompts in batches with the llm's tokenizer, then write the store"""
+        os.makedirs(store_dir, exist_ok=True)
+        meta_path = os.path.join(store_dir, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        unique = list(dict.fromkeys(prompts))
+        ids, offsets, prompt_hashes = array("i"), array("q", [0]), bytearray()
+        for start in range(0, len(unique), batch_size):
+            batch = unique[start:start + batch_size]
+            templated = llm.templateBatch([llm.getSystemRole() + llm.getMessages(prompt) for prompt in batch])
+            for prompt, prompt_ids in zip(templated, llm.tokenizer(templated, add_special_tokens=False)["input_ids"]):
+                ids.extend(prompt_ids)
+                offsets.append(len(ids))
+                prompt_hashes += hashlib.sha256(prompt.encode("utf-8")).digest()
+        keys = np.array([promptKey(prompt) for prompt in unique], dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        arrays = {
+            "ids": np.frombuffer(ids, dtype=np.int32),
+            "offsets": np.frombuffer(offsets, dtype=np.int64),
+            "keys": keys[order],
+            "rows": order.astype(np.int64),
+            "prompt_hashes": np.frombuffer(bytes(prompt_hashes), dtype=np.uint8).reshape(len(unique), 32),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(store_dir, name + ".npy"), values)
+        # written last, marks the store as complete
+        with open(meta_path, "w") as f:
+            json.dump(dict(meta, prompts=len(unique), tokens=len(ids)), f)
+        return PromptStore(arrays)
+
+    @classmethod
+    def load(cls, store_dir):
+        """Memory-map a complete store, None if there is none"""
+        if not os.path.exists(os.path.join(store_dir, "meta.json")):
+            return None
+        return cls({name: np.load(os.path.join(store_dir, name + ".npy"), mmap_mode="r") for name in cls.ARRAYS})
+
+def readDatasetPrompts(dataset_path, instructions):
+    """User prompts (query + the instruction of its type) of a type,query,truth dataset"""
+    prompts = []
+    with open(dataset_path, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        for row in reader:
+            if row and row[0] in instructions:
+                prompts.append(row[1] + instructions[row[0]])
+    return prompts
+
+def openPromptStore(llm, dataset_path, store_dir, instructions, batch_size=1024):
+    """The prompt store of a dataset for the llm's tokenizer and template, built on first use"""
+    template_fingerprint = llm.getTemplateFingerprint()
+    path = getStoreDir(store_dir, template_fingerprint, dataset_path)
+    store = PromptStore.load(path)
+    if store is None:
+        prompts = readDatasetPrompts(dataset_path, instructions)
+        meta = {"template": template_fingerprint, "dataset": os.path.abspath(dataset_path), "tokenizer": llm.tokenizer.name_or_path}
+        store = PromptStore.build(llm, prompts, path, meta, batch_size)
+        print(bcolors.GREEN + f"Pre-tokenized {len(store)} prompts of {dataset_path} into {path}" + bcolors.ENDC)
+    return store
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-tokenize the prompts of query datasets for a model's tokenizer and chat template.")
+    parser.add_argument("-query_dataset_path", type=str, nargs="+", required=True, help="Query datasets (type,query,truth CSV files)")
+    parser.add_argument("-model", type=str, default="meta-llama/Meta-Llama-3.1-8B-Instruct", help="Model whose tokenizer and chat template are used")
+    parser.add_argument("-prompt_store", type=str, default="prompt_store", help="Directory of the prompt stores")
+    parser.add_argument("-batch_size", type=int, default=1024, help="Number of prompts tokenized together")
+    args = parser.parse_args()
+
+    from getResponses import getInstructions
+    from llm_class import PlainLLM
+    llm = PlainLLM(args.model, tokenizer_only=True)
+    instructions = getInstructions()
+    for dataset_path in args.query_dataset_path:
+        store = openPromptStore(llm, dataset_path, args.prompt_store, instructions, args.batch_size)
+        print(f"{dataset_path}: {len(store)} prompts, {len(store.ids)} tokens")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import csv
+import hashlib
+import os
+import re
+import unicodedata
+
+# Cross-dataset query deduplication: every unique (type, query) is answered once and fanned back out
+
+UNIQUE_QUERIES_FILE = "unique_queries.csv"
+UNIQUE_RESPONSES_FILE = "unique_responses.csv"
+
+whitespace = re.compile(r"\s+")
+# per-type datasets (query,truth) take their question type from the file name
+TYPE_FILE_PATTERN = re.compile(r"queries_(yesno|radio|checkbox)\b")
+FILE_TYPES = {"yesno": "yes/no", "radio": "radio", "checkbox": "checkbox"}
+
+def normalizeQuery(query):
+    """Unicode-normalized, case-folded query with collapsed whitespace"""
+    return whitespace.sub(" ", unicodedata.normalize("NFKC", query)).strip().casefold()
+
+def getQueryKey(qtype, query):
+    return hashlib.sha1((qtype.strip() + "\x1f" + normalizeQuery(query)).encode("utf-8")).hexdigest()
+
+def getFileType(dataset_path):
+    """Question type of a per-type dataset without a type column (queries_<type>.csv)"""
+    match = TYPE_FILE_PATTERN.search(os.path.basename(dataset_path))
+    if match is None:
+        raise ValueError(f"{dataset_path} has no 'type' column and its name is not queries_<yesno|radio|checkbox>.csv")
+    return FILE_TYPES[match.group(1)]
+
+class QueryPlan:
+    """Unique (type, query, truth) rows of a set of datasets, and the unique row each input row is answered by"""
+
+    def __init__(self, dataset_paths):
+        self.dataset_paths = list(dataset_paths)
+        # query key -> index in unique_rows; the first occurrence is the one sent to the model
+        self.unique_index = {}
+        self.unique_rows = []
+        # per dataset (in the order given, a dataset may be listed twice): its header and [(input row, query key)]
+        self.headers = []
+        self.assignments = []
+        for dataset_path in self.dataset_paths:
+            rows = []
+            with open(dataset_path, "r", newline="") as f:
+                reader = csv.DictReader(f)
+                file_type = None if "type" in reader.fieldnames else getFileType(dataset_path)
+                for row in reader:
+                    if not row.get("query"):
+                        continue
+                    qtype = row["type"] if file_type is None else file_type
+                    key = getQueryKey(qtype, row["query"])
+                    if key not in self.unique_index:
+                        self.unique_index[key] = len(self.unique_rows)
+                        self.unique_rows.append([qtype, row["query"], row["truth"]])
+                    rows.append(([row[name] for name in reader.fieldnames], key))
+            self.headers.append(reader.fieldnames)
+            self.assignments.append(rows)
+
+    def getTotalQueries(self):
+        return sum(len(rows) for rows in self.assignments)
+
+    def getDuplicateQueries(self):
+        return self.getTotalQueries() - len(self.unique_rows)
+
+    def writeUniqueQueries(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["type", "query", "truth"])
+            writer.writerows(self.unique_rows)
+
+    def getOutputPaths(self, output_dir):
+        """Output file in output_dir of every dataset (its file name, numbered when two datasets share it)"""
+        paths, used = [], set()
+        inputs = {os.path.abspath(dataset_path) for dataset_path in self.dataset_paths}
+        for index, dataset_path in enumerate(self.dataset_paths):
+            name = os.path.basename(dataset_path)
+            if name in used or name in (UNIQUE_QUERIES_FILE, UNIQUE_RESPONSES_FILE):
+                name = f"{index}_{name}"
+            # never overwrite an input dataset
+            if os.path.abspath(os.path.join(output_dir, name)) in inputs:
+                root, extension = os.path.splitext(name)
+                name = f"{root}_responses{extension}"
+            used.add(name)
+            paths.append(os.path.join(output_dir, name))
+        return paths
+
+    def fanOut(self, responses_path, output_dir):
+        """Write every input row (its own columns) with the response of its unique query, one output file per dataset"""
+        responses = {}
+        with open(responses_path, "r", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header
+            for row in reader:
+                if row:
+                    responses[getQueryKey(row[0], row[1])] = row[-1]
+        output_paths = self.getOutputPaths(output_dir)
+        for output_path, header, rows in zip(output_paths, self.headers, self.assignments):
+            with open(output_path, "w", newline="") as f:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(header + ["response"])
+                for row, key in rows:
+                    writer.writerow(row + [responses[key]])
+        return list(zip(self.dataset_paths, output_paths))
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+# Persistent response cache
+class ResponseCache:
+    """SQLite (WAL) cache of generated responses, keyed by model, quantization, templated prompt, decoding params and sample index"""
+
+    def __init__(self, path, max_entries=None, max_age_days=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        # evict every evict_every inserts too, so that a long (or crashed) run stays within about 10% of max_entries
+        self.evict_every = max(1, min(1000, max_entries // 10)) if max_entries else 1000
+        self.inserts = 0
+        # wait for the write lock of other worker processes instead of failing; a model server
+        # creates the cache in its main thread and uses it from its model thread only
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # WAL lets concurrent runs read while one of them writes
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def hashPrompt(prompt):
+        """sha256 of a templated prompt, as stored in pre-tokenized prompt stores"""
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def makeKey(model_id, quantization, prompt_hash, decoding_params, sample_index):
+        key = json.dumps([model_id, quantization, prompt_hash, decoding_params, sample_index], sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, keys):
+        """Return {key: response} for the cached keys"""
+        found = {}
+        keys = list(keys)
+        # stay below the SQLite host parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(f"SELECT key, response FROM responses WHERE key IN ({placeholders})", chunk)
+            found.update(rows.fetchall())
+        if found:
+            now = time.time()
+            self.conn.executemany("UPDATE responses SET accessed = ? WHERE key = ?", [(now, key) for key in found])
+            self.conn.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put(self, responses):
+        """Store {key: response}"""
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+            [(key, response, now, now) for key, response in responses.items()]
+        )
+        self.conn.commit()
+        self.inserts += len(responses)
+        if self.inserts >= self.evict_every:
+            self.evict()
+
+    def evict(self):
+        """Drop entries older than max_age_days, then the least recently used ones beyond max_entries"""
+        if self.max_age_days is not None:
+            self.conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age_days * 86400,))
+        if self.max_entries is not None:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+        self.conn.commit()
+        self.inserts = 0
+
+    def getStats(self):
+        entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate, "entries": entries}
+
+    def close(self):
+        self.evict()
+        self.conn.close()
@@ -0,0 +1,98 @@
+import random
+import re
+from collections import Counter, defaultdict
+from evaluate import bootstrap_metrics, count_label_pairs, metrics_from_counts
+
+# Sequential (anytime) evaluation: queries are answered in a stratified random order and the run stops once the
+# confidence interval of the target metric is narrow enough for every question type
+
+# question type -> evaluate.py label type
+LABEL_TYPES = {"yes/no": "BINARY", "radio": "MULTICLASS", "checkbox": "MULTILABEL"}
+
+radio_option = re.compile(r"\b([a-e])\. (.*?)(?= [a-e]\. |$)")
+
+def getRelationPattern():
+    # longest relation first, so that "adjacent to and north" wins over "north"
+    from generateQuestionsFromRDF import INVERSE_RELATION
+    relations = sorted(set(INVERSE_RELATION) | {"intersect"}, key=len, reverse=True)
+    return re.compile(r"\b(" + "|".join(re.escape(relation) for relation in relations) + r")")
+
+def getQueryRelation(qtype, query, truth, relation_pattern):
+    """Spatial relation a query asks about: the true option of a radio question, the relation named in the others"""
+    if qtype == "radio":
+        options = dict(radio_option.findall(query.split("Options:")[-1]))
+        text = options.get(truth.strip(), "")
+    else:
+        text = query
+    match = relation_pattern.search(text)
+    return match.group(1) if match else "other"
+
+def stratifiedOrder(rows, seed=None):
+    """
+    Dataset rows in a random order in which every prefix holds each (type, relation) stratum in proportion to its
+    size: the i-th of the n rows of a stratum (shuffled) is placed at (i + u) / n, u uniform in [0, 1)
+    """
+    rng = random.Random(seed)
+    relation_pattern = getRelationPattern()
+    strata = defaultdict(list)
+    for row in rows:
+        strata[(row[0], getQueryRelation(row[0], row[1], row[2], relation_pattern))].append(row)
+    keyed = []
+    for stratum_rows in strata.values():
+        rng.shuffle(stratum_rows)
+        keyed += [((i + rng.random()) / len(stratum_rows), row) for i, row in enumerate(stratum_rows)]
+    keyed.sort(key=lambda item: item[0])
+    return [row for _, row in keyed]
+
+class SequentialEvaluation:
+    """Online evaluate.py metrics per question type, with bootstrap intervals on the target metric"""
+
+    def __init__(self, types, tolerance, metric="f1", confidence=0.95, min_queries=30, resamples=1000, seed=None):
+        # the question types of the dataset, each of them has to settle
+        self.types = [qtype for qtype in types if qtype in LABEL_TYPES]
+        self.tolerance = tolerance
+        self.metric = metric
+        self.confidence = confidence
+        self.min_queries = min_queries
+        self.resamples = resamples
+        self.seed = seed
+        self.counts = {qtype: Counter() for qtype in self.types}
+        self.invalid = {qtype: {'truth': set(), 'response': set()} for qtype in self.types}
+        self.answered = {qtype: {"truth": [], "response": []} for qtype in self.types}
+        # question type -> interval of the last check, recomputed when the type received new answers
+        self.intervals = {}
+
+    def update(self, rows, responses):
+        """Add answered dataset rows (type, query, truth) and their responses"""
+        for row, response in zip(rows, responses):
+            qtype = row[0]
+            if qtype not in self.answered:
+                continue
+            count_label_pairs([row[2]], [response], LABEL_TYPES[qtype], self.counts[qtype], self.invalid[qtype])
+            self.answered[qtype]["truth"].append(row[2])
+            self.answered[qtype]["response"].append(response)
+            self.intervals.pop(qtype, None)
+
+    def getInterval(self, qtype):
+        """{rows, metric, low, high, half_width} of the target metric of a question type"""
+        if qtype not in self.intervals:
+            df = self.answered[qtype]
+            rows = len(df["truth"])
+            value = metrics_from_counts(self.counts[qtype], LABEL_TYPES[qtype], rows)[self.metric]
+            if rows:
+                bounds = bootstrap_metrics(df, LABEL_TYPES[qtype], self.resamples, self.confidence, self.seed)
+                low, high = bounds[f"{self.metric}_low"], bounds[f"{self.metric}_high"]
+            else:
+                low, high = 0.0, 1.0
+            self.intervals[qtype] = {"rows": rows, self.metric: value, "low": low, "high": high, "half_width": (high - low) / 2}
+        return self.intervals[qtype]
+
+    def isSettled(self, qtype):
+        if len(self.answered[qtype]["truth"]) < self.min_queries:
+            return False
+        interval = self.getInterval(qtype)
+        return interval["half_width"] <= self.tolerance
+
+    def isDone(self):
+        """True once the target metric of every question type is within the tolerance"""
+        return all(self.isSettled(qtype) for qtype in self.types)
@@ -0,0 +1,77 @@
+import random
+import pytest
+import evaluate
+
+metrics = pytest.importorskip("sklearn.metrics")
+preprocessing = pytest.importorskip("sklearn.preprocessing")
+
+ROWS = 500
+
+def sklearn_metrics(y_true, y_pred, **kwargs):
+    return {
+        "precision": metrics.precision_score(y_true, y_pred, zero_division=0, **kwargs),
+        "recall": metrics.recall_score(y_true, y_pred, zero_division=0, **kwargs),
+        "f1": metrics.f1_score(y_true, y_pred, zero_division=0, **kwargs),
+    }
+
+def assert_same_metrics(ours, theirs):
+    for name in ("precision", "recall", "f1"):
+        assert ours[name] == pytest.approx(theirs[name], abs=1e-12), name
+
+def random_checkbox(rng):
+    labels = rng.sample("abcd", rng.randint(0, 4))
+    return ",".join(sorted(labels)) if labels else rng.choice(["e", ""])
+
+@pytest.mark.parametrize("seed", range(5))
+def test_binary_matches_sklearn(seed):
+    rng = random.Random(seed)
+    df = {
+        "truth": [rng.choice(["yes", "no"]) for _ in range(ROWS)],
+        "response": [rng.choice(["yes", "no", "yes", "no", "maybe", ""]) for _ in range(ROWS)],
+    }
+    # rows outside yes/no are ignored
+    valid = [(t, p) for t, p in zip(df["truth"], df["response"]) if p in ("yes", "no")]
+    expected = sklearn_metrics([t for t, _ in valid], [p for _, p in valid], pos_label="yes")
+    assert_same_metrics(evaluate.evaluate_binary(df, verbose=False), expected)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_multiclass_matches_sklearn(seed):
+    rng = random.Random(seed)
+    df = {
+        "truth": [rng.choice("abcde") for _ in range(ROWS)],
+        "response": [rng.choice(["a", "b", "c", "d", "e", " b", "f", "a,b"]) for _ in range(ROWS)],
+    }
+    # rows outside a-e are ignored, the macro average covers the labels of either column
+    valid = [(t, p.strip()) for t, p in zip(df["truth"], df["response"]) if p.strip() in set("abcde")]
+    expected = sklearn_metrics([t for t, _ in valid], [p for _, p in valid], average="macro")
+    assert_same_metrics(evaluate.evaluate_multiclass(df, verbose=False), expected)
+
+@pytest.mark.parametrize("seed", range(5))
+def test_multilabel_matches_sklearn(seed):
+    rng = random.Random(seed)
+    df = {
+        "truth": [random_checkbox(rng) for _ in range(ROWS)],
+        "response": [random_checkbox(rng) for _ in range(ROWS)],
+    }
+    binarizer = preprocessing.MultiLabelBinarizer(classes=list("abcde"))
+    binarizer.fit([])
+    def binarize(values):
+        return binarizer.transform([[label for label in value.split(",") if label] for value in values])
+    expected = sklearn_metrics(binarize(df["truth"]), binarize(df["response"]), average="samples")
+    assert_same_metrics(evaluate.evaluate_multilabel(df, verbose=False), expected)
+
+@pytest.mark.parametrize("task", sorted(evaluate.EVALUATORS))
+def test_stream_matches_in_memory(tmp_path, task):
+    rng = random.Random(0)
+    values = {"yesno": lambda: rng.choice(["yes", "no", "maybe"]), "radio": lambda: rng.choice("abcdef"),
+              "checkbox": lambda: random_checkbox(rng)}[task]
+    path = tmp_path / f"model_responses_{task}.csv"
+    df = {"truth": [values() for _ in range(ROWS)], "response": [values() for _ in range(ROWS)]}
+    with open(path, "w") as f:
+        f.write("truth,response\n")
+        for truth, response in zip(df["truth"], df["response"]):
+            f.write(f'"{truth}","{response}"\n')
+    label_type, evaluator = evaluate.EVALUATORS[task]
+    # chunk boundaries do not change the counts
+    streamed = evaluate.evaluate_stream(str(path), label_type, chunk_rows=7, verbose=False)
+    assert streamed == evaluator(evaluate.read_responses(str(path)), verbose=False)
@@ -0,0 +1,94 @@
+import csv
+import random
+import pytest
+
+pytest.importorskip("tqdm")
+from collections import Counter
+import getResponses
+
+def write_dataset(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["type", "query", "truth"])
+        for row in rows:
+            # blank lines are skipped by the readers
+            if row is None:
+                f.write("\n")
+            else:
+                writer.writerow(row)
+
+def make_rows(seed, size=53):
+    rng = random.Random(seed)
+    queries = [("yesno", f"Is {i} north of {i + 1}?", rng.choice(["yes", "no"])) for i in range(20)]
+    # duplicated queries must keep one answer per occurrence
+    rows = [list(rng.choice(queries)) for _ in range(size)]
+    for index in sorted(rng.sample(range(size), 5), reverse=True):
+        rows.insert(index, None)
+    return rows
+
+def answer(row):
+    return f"{row[1]}|{row[2]}"
+
+def answer_into(dataset_path, output_path, answered, shard=0, num_shards=1, append=False):
+    with open(output_path, "a" if append else "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        if not append:
+            writer.writerow(["type", "query", "truth", "response"])
+        for batch in getResponses.readBatches(dataset_path, 4, answered, shard, num_shards):
+            for row in batch:
+                writer.writerow(row + [answer(row)])
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+@pytest.mark.parametrize("num_shards", [1, 2, 3, 7])
+def test_merged_shards_match_single_run(tmp_path, num_shards):
+    dataset_path = str(tmp_path / "dataset.csv")
+    write_dataset(dataset_path, make_rows(num_shards))
+    single_path = str(tmp_path / "single.csv")
+    answer_into(dataset_path, single_path, Counter())
+
+    output_path = str(tmp_path / "responses.csv")
+    for shard in range(num_shards):
+        answer_into(dataset_path, getResponses.getShardPath(output_path, shard), Counter(), shard, num_shards)
+    getResponses.mergeShards(output_path, num_shards)
+    assert read_rows(output_path) == read_rows(single_path)
+
+@pytest.mark.parametrize("answered_rows", [0, 1, 17, 53])
+def test_resumed_run_matches_single_run(tmp_path, answered_rows):
+    dataset_path = str(tmp_path / "dataset.csv")
+    write_dataset(dataset_path, make_rows(answered_rows))
+    single_path = str(tmp_path / "single.csv")
+    answer_into(dataset_path, single_path, Counter())
+    lines = open(single_path).read().splitlines(keepends=True)
+
+    # an interrupted run: the answered rows plus a partially written one
+    output_path = str(tmp_path / "responses.csv")
+    with open(output_path, "w") as f:
+        f.writelines(lines[:answered_rows + 1])
+        if answered_rows + 1 < len(lines):
+            f.write(lines[answered_rows + 1][:10])
+    answered = getResponses.readAnsweredQueries(output_path)
+    assert sum(answered.values()) == answered_rows
+    answer_into(dataset_path, output_path, answered, append=True)
+    assert read_rows(output_path) == read_rows(single_path)
+
+def test_resumed_shards_match_single_run(tmp_path):
+    dataset_path = str(tmp_path / "dataset.csv")
+    write_dataset(dataset_path, make_rows(0))
+    single_path = str(tmp_path / "single.csv")
+    answer_into(dataset_path, single_path, Counter())
+
+    output_path = str(tmp_path / "responses.csv")
+    for shard in range(3):
+        shard_path = getResponses.getShardPath(output_path, shard)
+        answer_into(dataset_path, shard_path, Counter(), shard, 3)
+        # shard 1 failed halfway and is finished with -resume
+        if shard == 1:
+            lines = open(shard_path).read().splitlines(keepends=True)
+            with open(shard_path, "w") as f:
+                f.writelines(lines[:len(lines) // 2])
+            answer_into(dataset_path, shard_path, getResponses.readAnsweredQueries(shard_path), shard, 3, append=True)
+    getResponses.mergeShards(output_path, 3)
+    assert read_rows(output_path) == read_rows(single_path)